@@ -1,75 +1,128 @@
 # .aud files converter to wav
 # [Author: Nicodemo Gawronski] Need help? write: nico AT deftlinux dot net
-# 
+#
+# The .aud files are streamed into a bounded pool of ffmpeg processes with the amr header
+# prepended on the fly, the source tree is never copied. The md5 of every converted source
+# is kept in the output folder, so a re-run only converts new or changed files.
 
-import os, argparse, codecs, re, sys, shutil,subprocess
+import os, argparse, sys, shutil, subprocess, hashlib, json, errno
 from datetime import datetime
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
-def arm_header(converted):
-    sys.stdout.write("Appending the arm header to the .aud files...")    
-    for dirname, dirnames, filenames in os.walk(converted):
+header = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "audio_header", "amr_header.bin"), 'rb').read()
+hash_file = "aud_hashes.json"
 
-        header= "audio_header/amr_header.bin"
+def source_hash(aud_file):
+    md5 = hashlib.md5()
+    f = open(aud_file, 'rb')
+    for block in iter(lambda: f.read(1 << 16), ''):
+        md5.update(block)
+    f.close()
+    return md5.hexdigest()
+
+#List the .aud files with their .wav target, skipping the ones already converted from the same source.
+def plan_audio(audio_src, converted, hashes):
+    todo = []
+    skipped = 0
+    for dirname, dirnames, filenames in os.walk(audio_src):
         for filename in filenames:
-            #print os.path.join(dirname, filename)
+            if not filename.endswith(".aud"):
+                continue
             aud_file = os.path.join(dirname, filename)
-            new_arm = os.path.join(dirname, filename).replace(".aud", ".arm", 1)
-            #print new_arm
-            #with open(new_arm, 'wb') as f:
-            file(new_arm,'wb').write(file(header,'rb').read()+file(aud_file,'rb').read())
-    print("done!")
+            rel = os.path.relpath(aud_file, audio_src)
+            to_wav = os.path.join(converted, rel[:-len(".aud")]+".wav")
+            digest = source_hash(aud_file)
+            if hashes.get(rel) == digest and os.path.exists(to_wav):
+                skipped += 1
+                continue
+            todo.append((aud_file, to_wav, rel, digest))
+    return todo, skipped
 
-#Convert the chat audio files from arm to wav.
-def convert_audio(converted):
-    sys.stdout.write("Converting the .arm files to wav...")
-    for dirname, dirnames, filenames in os.walk(converted):
+#Stream the arm header and the .aud file into ffmpeg, the wav only gets its name once complete.
+def convert_one(job):
+    aud_file, to_wav, rel, digest = job
+    try:
+        os.makedirs(os.path.dirname(to_wav))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    partial = to_wav+".part"
+    black_hole = open(os.devnull, "w")
+    ffmpeg = subprocess.Popen(["ffmpeg", "-y", "-f", "amr", "-i", "pipe:0", "-f", "wav", partial],
+                              stdin = subprocess.PIPE, stdout = black_hole, stderr = black_hole)
+    try:
+        ffmpeg.stdin.write(header)
+        src = open(aud_file, 'rb')
+        shutil.copyfileobj(src, ffmpeg.stdin)
+        src.close()
+        ffmpeg.stdin.close()
+    except IOError:
+        # ffmpeg quit early, its return code tells
+        pass
+    code = ffmpeg.wait()
+    black_hole.close()
+    if code != 0:
+        if os.path.exists(partial):
+            os.remove(partial)
+        return rel, None
+    os.rename(partial, to_wav)
+    return rel, digest
 
-        for filename in filenames:
-            print os.path.join(dirname, filename)
-            if ".arm" in os.path.join(dirname, filename):
-				convert_this = os.path.join(dirname, filename)
-				to_wav = convert_this.replace(".arm", ".wav", 1)
-				black_hole = open("black_hole", "w")
-				subprocess.call(["ffmpeg", "-i", convert_this, to_wav], stdout = black_hole, stderr = black_hole)
-				black_hole.close()
-    print("done!")
+#Convert the chat audio files from aud to wav.
+def convert_audio(audio_src, converted, jobs):
+    hashes = {}
+    hash_path = os.path.join(converted, hash_file)
+    if os.path.exists(hash_path):
+        hashes = json.load(open(hash_path))
+    sys.stdout.write("Looking for new .aud files... ")
+    todo, skipped = plan_audio(audio_src, converted, hashes)
+    print("%d to convert, %d up to date" % (len(todo), skipped))
 
-def clean_old_audio(converted):
-    sys.stdout.write("Taking out the trash (old copies of .aud files)... ")
-    delete = "black_hole"
-    os.remove(delete)
-	
-    for dirname, dirnames, filenames in os.walk(converted):
-        for filename in filenames:
-            #print os.path.join(dirname, filename)
-            if ".arm" in os.path.join(dirname, filename) or ".aud" in os.path.join(dirname, filename):
-                delete_this = os.path.join(dirname, filename)
-                os.remove(delete_this)
-    print("done!")
+    jobs = max(1, jobs)
+    sys.stdout.write("Converting the .aud files to wav with %d ffmpeg processes...\n" % jobs)
+    failed = 0
+    pool = ThreadPool(jobs)
+    for rel, digest in pool.imap_unordered(convert_one, todo):
+        if digest is None:
+            failed += 1
+            print "failed: "+rel
+        else:
+            hashes[rel] = digest
+    pool.close()
+    pool.join()
+    if not os.path.isdir(converted):
+        os.makedirs(converted)
+    f = open(hash_path, "w")
+    json.dump(hashes, f)
+    f.close()
+    print("done! %d converted, %d failed" % (len(todo)-failed, failed))
+    return failed
 
-class Main(argparse.Action):
-     def __call__(self, parser, namespace, values, option_string=None):
-         
-         audio_src = values
-         print audio_src
-         now = datetime.utcnow()
-         now = datetime.strptime(str(now), '%Y-%m-%d %H:%M:%S.%f')
-         now = now.strftime('%d-%m-%Y %H.%M.%S')
-         converted = now+"_converted"
-         try:
-             #Copy Audio files
-             shutil.copytree(audio_src, converted)
-             #Append ARM header to audio files and Convert them to ogg format
-             arm_header(converted)
-             convert_audio(converted)
-             clean_old_audio(converted)
-         except:
-             print("Something went wrong converting the audio files...")
+def main(args):
+    audio_src = args.Folder
+    print audio_src
+    converted = args.output
+    if converted is None:
+        now = datetime.utcnow()
+        now = datetime.strptime(str(now), '%Y-%m-%d %H:%M:%S.%f')
+        now = now.strftime('%d-%m-%Y %H.%M.%S')
+        converted = now+"_converted"
+    try:
+        failed = convert_audio(audio_src, converted, args.jobs)
+    except (IOError, OSError, ValueError) as e:
+        print("Something went wrong converting the audio files: %s" % e)
+        sys.exit(1)
+    if failed:
+        sys.exit(1)
 
 
 
 parser = argparse.ArgumentParser(description=".aud converter: convert wechat .aud files into .wav", epilog="Wechat Xtractor is an open source tool written for DEFT 8 under the GNU GPLv3 license. If you have any trouble or if you find a bug please report it on DEFT forum at http://www.deftlinux.net/forum/ or write an email to the developer at nico@deftlinux.net")
-parser.add_argument("Folder", action=Main, help=".aud files root folder.")
+parser.add_argument("Folder", help=".aud files root folder.")
+parser.add_argument("-o", "--output", help="output folder, reuse it to only convert new .aud files (default: a new timestamped folder)")
+parser.add_argument("-j", "--jobs", type=int, default=cpu_count(), help="number of concurrent ffmpeg processes")
 
 
-args = parser.parse_args()
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+The MIT License (MIT)
+
+Copyright (c) 2014 Jianxia Xue xuejianxia@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+benchmarks of the export pipeline on a synthetic backup (synthetic_db.py), offline
+
+Every benchmark is run --repeat times and reported as json: the settings, the versions and
+per benchmark the seconds of every run, the min and the median. With --compare the results
+are checked against an earlier json, the exit status is 1 when a median is more than
+--tolerance slower.
+
+usage: python benchmark.py --messages 50000 --days 180 --output bench.json [--compare base.json]
+"""
+import os, sys, time, json, shutil, tempfile, platform, sqlite3, argparse
+
+import synthetic_db
+from chat_calendar import str2epoch, epoch2str, DailyTimestampStep
+from data_extract import Chat2HTML_EXPORTER
+
+# the median of a list of numbers
+def median( values ):
+    values = sorted(values)
+    n = len(values)
+    return values[n/2] if n % 2 else (values[n/2-1]+values[n/2])/2.0
+
+def timeRuns( function, repeat ):
+    runs = []
+    for i in range(repeat):
+        t = time.time()
+        function()
+        runs.append(time.time()-t)
+    return {'runs': runs, 'min': min(runs), 'median': median(runs)}
+
+class Benchmarks:
+    """
+    The exporter stages timed on the first month of the synthetic chat, and the full archive
+    """
+    def __init__(self, root, start, days):
+        self.root = root
+        self.start = start
+        self.stop = epoch2str(str2epoch(start)+days*DailyTimestampStep)
+        a = str2epoch(start)
+        self.period = (a, min(a+30*DailyTimestampStep, str2epoch(self.stop)))
+
+    def _exporter(self, **kw):
+        exporter = Chat2HTML_EXPORTER(dbFolder=self.root, htmlFolder=os.path.join(self.root, 'html')+'/', **kw)
+        exporter._openDB()
+        exporter.timeFrame = exporter._get_timeFrame_from_timestamp(*self.period)
+        return exporter
+
+    def getMessageStat(self):
+        exporter = self._exporter()
+        return lambda: exporter.getMessageStat(exporter.cur, exporter.timeFrame)
+
+    def getSpeakerInfo(self):
+        exporter = self._exporter()
+        return lambda: exporter.getSpeakerInfo(exporter.cur, exporter.timeFrame)
+
+    def getMessages(self):
+        exporter = self._exporter()
+        exporter.getSpeakerInfo(exporter.cur, exporter.timeFrame)
+        return lambda: exporter.getMessages(exporter.cur, exporter.timeFrame)
+
+    def _updateSpeakerGraph(self):
+        exporter = self._exporter()
+        exporter.getSpeakerInfo(exporter.cur, exporter.timeFrame)
+        exporter.getMessages(exporter.cur, exporter.timeFrame)
+        messages = [(item.speaker, item.timestamp) for item in exporter.records]
+        def replay():
+            exporter._initSpeakerGraph()
+            update = exporter._updateSpeakerGraph
+            for speaker, timestamp in messages:
+                update(speaker, timestamp)
+        return replay
+
+    def exportHTML(self):
+        exporter = self._exporter()
+        exporter._setMonthlyPeriod(self.period[0])
+        exporter._queryData(exporter.timeFrame, exporter.cur)
+        exporter.queryName = 'benchmark'
+        exporter.speakerGraphs = exporter._initQueryStatistics()
+        exporter.speakerGraphs['monthly'] = exporter._ensembleSpeakerGraph()
+        return exporter.exportHTML
+
+    def saveDailyArchive(self):
+        exporter = self._exporter()
+        exporter._closeDB()
+        return lambda: exporter.saveDailyArchive(self.start, self.stop)
+
+    def saveDailyArchive_singleScan(self):
+        exporter = self._exporter()
+        exporter._closeDB()
+        return lambda: exporter.saveDailyArchive(self.start, self.stop, singleScan=True)
+
+    def saveDailyArchive_pipeline(self):
+        exporter = self._exporter(pipeline=True)
+        exporter._closeDB()
+        return lambda: exporter.saveDailyArchive(self.start, self.stop, singleScan=True)
+
+    names = ['getMessageStat', 'getSpeakerInfo', 'getMessages', '_updateSpeakerGraph', 'exportHTML',
+             'saveDailyArchive', 'saveDailyArchive_singleScan', 'saveDailyArchive_pipeline']
+
+    def run(self, names, repeat):
+        results = {}
+        for name in names:
+            function = getattr(self, name)()
+            results[name] = timeRuns(function, repeat)
+            print >> sys.stderr, '...%s %.4fs' % (name, results[name]['median'])
+        return results
+
+# the benchmarks more than tolerance slower than in the baseline, as (name, baseline, current)
+def compare( baseline, results, tolerance ):
+    slower = []
+    for name, result in sorted(results.iteritems()):
+        if not baseline.has_key(name):
+            continue
+        before = baseline[name]['median']
+        ratio = result['median']/before if before > 0 else 1.0
+        print >> sys.stderr, '%-30s %9.4fs %9.4fs %6.2fx' % (name, before, result['median'], ratio)
+        if ratio > 1+tolerance:
+            slower.append((name, before, result['median']))
+    return slower
+
+
+parser = argparse.ArgumentParser(description="benchmark the exporter on a synthetic MM.sqlite")
+parser.add_argument("--root", help="folder of the synthetic backup, kept (default: a temporary folder)")
+parser.add_argument("--messages", type=int, default=20000)
+parser.add_argument("--speakers", type=int, default=30)
+parser.add_argument("--start", default="2014-01-01")
+parser.add_argument("--days", type=int, default=90)
+parser.add_argument("--seed", type=int, default=1)
+parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark")
+parser.add_argument("--only", nargs='*', choices=Benchmarks.names, help="run these benchmarks only")
+parser.add_argument("--output", help="json file of the results (default: stdout)")
+parser.add_argument("--compare", help="json results of an earlier run")
+parser.add_argument("--tolerance", type=float, default=0.2, help="accepted slowdown against --compare")
+
+def main(args):
+    root = args.root or tempfile.mkdtemp(prefix='wechat_benchmark_')
+    # the progress of the exporter goes to stderr, stdout only gets the json
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        counts = synthetic_db.generate(root, args.messages, args.speakers, args.start, args.days, 1, args.seed)
+        bench = Benchmarks(root, args.start, args.days)
+        results = bench.run(args.only or Benchmarks.names, args.repeat)
+    finally:
+        sys.stdout = stdout
+        if args.root is None:
+            shutil.rmtree(root)
+    report = {'settings': {'messages': args.messages, 'speakers': args.speakers, 'start': args.start,
+                           'days': args.days, 'seed': args.seed, 'repeat': args.repeat},
+              'system': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                         'platform': platform.platform(), 'time': time.strftime('%Y-%m-%d %H:%M:%S')},
+              'rows': counts.values()[0],
+              'results': results}
+    output = json.dumps(report, indent=1, sort_keys=True)
+    if args.output:
+        fid = open(args.output, 'w')
+        fid.write(output)
+        fid.close()
+    else:
+        print output
+    if args.compare:
+        fid = open(args.compare)
+        baseline = json.load(fid)['results']
+        fid.close()
+        slower = compare(baseline, results, args.tolerance)
+        for name, before, after in slower:
+            print >> sys.stderr, 'slower: %s %.4fs -> %.4fs' % (name, before, after)
+        return 1 if slower else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args()))
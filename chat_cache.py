@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+The MIT License (MIT)
+
+Copyright (c) 2014 Jianxia Xue xuejianxia@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+the rendered messages kept between runs in a sidecar sqlite database: an entry is found by the
+chat table and MsgLocalID and only used while the hash of the Message column and the attachment
+fingerprint are unchanged. The least recently used entries are dropped once there are more than
+the given size, and all the entries of a chat go when the templates changed.
+"""
+import sqlite3, time
+
+Schema = ['''create table if not exists render(chat text, id integer, hash blob, fingerprint text, html text,
+              used integer, primary key(chat, id))''',
+          '''create index if not exists render_used on render(used)''',
+          '''create table if not exists signature(chat text primary key, signature text)''']
+
+class RenderCache(object):
+    """
+    The rendered messages of one chat table, the new entries and the uses are written on close
+    """
+    def __init__(self, dbFile, chat, signature, size=500000):
+        """
+        :param signature: the templates and settings the messages are rendered with
+        :param size: number of entries kept in the database, for all the chats
+        """
+        # the workers of a parallel export share the file
+        self.conn = sqlite3.connect(dbFile, timeout=60)
+        for sql in Schema:
+            self.conn.execute(sql)
+        self.chat = chat
+        self.size = size
+        self.stamp = int(time.time())
+        row = self.conn.execute('select signature from signature where chat = ?', (chat,)).fetchone()
+        if row is None or row[0] != signature:
+            self.conn.execute('delete from render where chat = ?', (chat,))
+            self.conn.execute('insert or replace into signature values (?, ?)', (chat, signature))
+        self.conn.commit()
+        # msgid: (hash, fingerprint, html) of the chat, read in one query on the first lookup
+        self.entries = None
+        self.added = {} # the entries rendered in this run
+        self.used = []
+
+    def get(self, msgid, digest, fingerprint):
+        entry = self.added.get(msgid)
+        if entry is not None:
+            return entry[2] if entry[:2] == (digest, fingerprint) else None
+        if self.entries is None:
+            self.entries = dict([(i, (str(h), f, html)) for i, h, f, html in self.conn.execute(
+                'select id, hash, fingerprint, html from render where chat = ?', (self.chat,))])
+        entry = self.entries.get(msgid)
+        if entry is None or entry[:2] != (digest, fingerprint):
+            return None
+        self.used.append(msgid)
+        return entry[2]
+
+    def put(self, msgid, digest, fingerprint, html):
+        self.added[msgid] = (digest, fingerprint, html)
+
+    def close(self):
+        conn = self.conn
+        conn.executemany('insert or replace into render values (?, ?, ?, ?, ?, ?)',
+                         [(self.chat, msgid, buffer(digest), fingerprint, html, self.stamp)
+                          for msgid, (digest, fingerprint, html) in self.added.iteritems()])
+        conn.executemany('update render set used = ? where chat = ? and id = ?',
+                         [(self.stamp, self.chat, msgid) for msgid in self.used])
+        excess = conn.execute('select count(*) from render').fetchone()[0] - self.size
+        if excess > 0:
+            conn.execute('delete from render where rowid in (select rowid from render order by used limit ?)',
+                         (excess,))
+        conn.commit()
+        conn.close()
+        self.entries = self.added = self.used = None
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+The MIT License (MIT)
+
+Copyright (c) 2014 Jianxia Xue xuejianxia@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+calendar of the chat exporter: the timestamp conversions, and the export calendar that
+computes the daily steps, weeks and months of an export range once
+"""
+import time, datetime
+
+"""
+ Timestamp related conversions
+"""
+DailyTimestampStep = 24*3600;
+
+def str2epoch( yyyy_mm_dd ):
+    return int(time.mktime(datetime.datetime.strptime(yyyy_mm_dd,"%Y-%m-%d").timetuple()))
+
+def epoch2str( timestamp ):
+    return time.strftime('%Y-%m-%d', time.localtime(float(timestamp)))
+# return the timestamp difference in munites
+def minute_distance( tstamp1, tstamp2 ):
+    d = datetime.timedelta(seconds = tstamp2-tstamp1)
+    return d.minutes
+# return true if the timestamp is on the first day of a month
+def isMonthlyStart( timestamp ):
+    t = time.localtime(float(timestamp));
+    return t[2] == 1
+# return true if the timestamp is on a Monday as the beginning of a week
+def isWeeklyStart( timestamp ):
+    t = time.localtime(float(timestamp));
+    d = datetime.date(t[0], t[1], t[2])
+    return d.isoweekday()==1
+# return the timestamp of the begining of the following month from the given timestamp month
+def nextMonth( timestamp ):
+    t = time.localtime(float(timestamp));
+    y = t[0]
+    m = t[1]+1
+    if m == 13:
+        m = 1
+        y += 1    
+    return int(time.mktime([y, m, 1, 0, 0, 0, 0, 0, 0]))
+# return the timestamp of the begining of the following week from the given timestamp week
+def nextWeek( timestamp ):
+    t = time.localtime(float(timestamp));
+    y = t[0]
+    d = datetime.date(t[0], t[1], t[2])
+    diso = d.isocalendar()
+    d1 = d-datetime.timedelta(days=(diso[2]-1))    
+    d2 = d1+datetime.timedelta(weeks=1)
+    return int(time.mktime(d2.timetuple()))
+# the names and UTC offsets of the local timezone, the day boundaries of the localtime calls follow them
+def zoneSignature():
+    return [list(time.tzname), time.timezone, time.altzone, time.daylight]
+
+
+class ExportCalendar(object):
+    """
+    Memoized calendar of the biased timestamps of one exporter.
+
+    The timestamps used for periods and records are biased: CreateTime + bias. The conversion
+    in both directions only happens here. The day names, the months and weeks starting on a
+    daily step and the record time strings are computed once (precompute fills a whole export
+    range up front), so the export loops and the record rendering need no localtime calls.
+    """
+    # bound of the per minute time string cache
+    maxMinutes = 1 << 16
+
+    def __init__(self, bias=0):
+        """
+        :param bias: seconds added to CreateTime for the presentation of the timestamps
+        """
+        self.bias = bias
+        self.localtimes = {}
+        self.dates = {}
+        self.months = {}
+        self.weeks = {}
+        self.minutes = {}
+        self.quarters = {}
+
+    def biased(self, createTime):
+        return int(createTime)+self.bias
+
+    def unbiased(self, timestamp):
+        return timestamp-self.bias
+
+    # fill the caches for the daily steps from timestamp to stopTimeStamp
+    def precompute(self, timestamp, stopTimeStamp):
+        while timestamp < stopTimeStamp:
+            self.date(timestamp)
+            if self.isMonthlyStart(timestamp):
+                self.month(timestamp)
+            if self.isWeeklyStart(timestamp):
+                self.week(timestamp)
+            timestamp += DailyTimestampStep
+        return None
+
+    # the stop of the last monthly/weekly period starting before stopTimeStamp
+    def lastStop(self, stopTimeStamp):
+        return max(stopTimeStamp, nextMonth(stopTimeStamp-1), nextWeek(stopTimeStamp-1))
+
+    def localtime(self, timestamp):
+        t = self.localtimes.get(timestamp)
+        if t is None:
+            t = self.localtimes[timestamp] = time.localtime(float(timestamp))
+        return t
+
+    def date(self, timestamp):
+        d = self.dates.get(timestamp)
+        if d is None:
+            d = self.dates[timestamp] = time.strftime('%Y-%m-%d', self.localtime(timestamp))
+        return d
+
+    # the date of any timestamp, formatted once per quarter of an hour, the step of the time zone offsets
+    def day(self, timestamp):
+        quarter = timestamp // 900
+        d = self.quarters.get(quarter)
+        if d is None:
+            if len(self.quarters) >= self.maxMinutes:
+                self.quarters.clear()
+            d = self.quarters[quarter] = time.strftime('%Y-%m-%d', time.localtime(float(quarter*900)))
+        return d
+
+    def isMonthlyStart(self, timestamp):
+        return self.localtime(timestamp)[2] == 1
+
+    def isWeeklyStart(self, timestamp):
+        t = self.localtime(timestamp)
+        return datetime.date(t[0], t[1], t[2]).isoweekday()==1
+
+    # (local time, stop) of the month starting at timestamp
+    def month(self, timestamp):
+        m = self.months.get(timestamp)
+        if m is None:
+            m = self.months[timestamp] = (self.localtime(timestamp), nextMonth(timestamp))
+        return m
+
+    # (local time, stop, ISO week number) of the week starting at timestamp
+    def week(self, timestamp):
+        w = self.weeks.get(timestamp)
+        if w is None:
+            t = self.localtime(timestamp)
+            weekID = datetime.date(t[0], t[1], t[2]).isocalendar()[1]
+            w = self.weeks[timestamp] = (t, nextWeek(timestamp), weekID)
+        return w
+
+    # the same string as str(datetime.datetime.fromtimestamp(timestamp)), formatted once per minute
+    def timeString(self, timestamp):
+        if type(timestamp) not in (int, long):
+            return str(datetime.datetime.fromtimestamp(timestamp))
+        minute, second = divmod(timestamp, 60)
+        prefix = self.minutes.get(minute)
+        if prefix is None:
+            if len(self.minutes) >= self.maxMinutes:
+                self.minutes.clear()
+            prefix = self.minutes[minute] = str(datetime.datetime.fromtimestamp(minute*60))[:-2]
+        return '%s%02d' % (prefix, second)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+The MIT License (MIT)
+
+Copyright (c) 2014 Jianxia Xue xuejianxia@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+materialization of the attachment files of the phone backup under the names the pages use,
+without copying the data: a hard link, a reflink when the html folder is on another file system
+supporting it, a copy only when neither works, or symbolic links when asked for
+"""
+import os, errno, shutil
+from multiprocessing.pool import ThreadPool
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# the file name endings of the backup and of the pages, the longest first
+SuffixMap = [('.pic_thum', '.t.jpg'), ('.pic.thumb', '.t.jpg'), ('.pic', '.jpg')]
+# ioctl of linux cloning a file on btrfs, xfs and the like
+FICLONE = 0x40049409
+
+# the name of a backup file in the html folder
+def targetName( name ):
+    for suffix, renamed in SuffixMap:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]+renamed
+    return name
+
+def reflink( src, dst ):
+    if fcntl is None:
+        raise IOError(errno.EOPNOTSUPP, 'no reflink support')
+    s = open(src, 'rb')
+    d = open(dst, 'wb')
+    try:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    finally:
+        s.close()
+        d.close()
+
+# true when dst already holds src, as a link or as a copy of the same size and age
+def upToDate( src, dst, mode ):
+    if mode == 'symlink':
+        return os.path.islink(dst) and os.path.realpath(dst) == os.path.realpath(src)
+    if not os.path.exists(dst) or os.path.islink(dst):
+        return False
+    if os.path.samefile(src, dst):
+        return True
+    s = os.stat(src)
+    d = os.stat(dst)
+    # copy2 keeps the modification time only to the microsecond
+    return s.st_size == d.st_size and int(d.st_mtime) >= int(s.st_mtime)
+
+def materialize( job ):
+    """
+    make dst hold src, the file gets its name only once complete
+    :param job: (source file, target file, mode), mode 'link' or 'symlink'
+    :return: 'skipped', 'linked', 'reflinked', 'copied' or 'symlinked'
+    """
+    src, dst, mode = job
+    if upToDate(src, dst, mode):
+        return 'skipped'
+    folder = os.path.dirname(dst)
+    try:
+        os.makedirs(folder)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    partial = dst+'.part'
+    if os.path.lexists(partial):
+        os.remove(partial)
+    if mode == 'symlink':
+        os.symlink(os.path.abspath(src), partial)
+        result = 'symlinked'
+    else:
+        try:
+            os.link(src, partial)
+            result = 'linked'
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+            try:
+                reflink(src, partial)
+                result = 'reflinked'
+            except IOError:
+                shutil.copy2(src, partial)
+                result = 'copied'
+    os.rename(partial, dst)
+    return result
+
+# materialize (source, target) pairs with a pool of threads, the count of every result
+def materializeFiles( pairs, mode='link', jobs=4 ):
+    counts = {'skipped': 0, 'linked': 0, 'reflinked': 0, 'copied': 0, 'symlinked': 0}
+    if not pairs:
+        return counts
+    pool = ThreadPool(max(1, jobs))
+    for result in pool.imap_unordered(materialize, [(src, dst, mode) for src, dst in pairs], 64):
+        counts[result] += 1
+    pool.close()
+    pool.join()
+    return counts
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+The MIT License (MIT)
+
+Copyright (c) 2014 Jianxia Xue xuejianxia@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+the threads around the rendering of an export: a reader fetching the row batches of the message
+scan ahead, and a writer writing the finished pages behind. sqlite and the file writes release
+the interpreter lock, so both overlap with the rendering; the bounded queues hold the faster
+stage back, at most depth batches or pages wait in memory.
+"""
+import sys, os, threading, Queue
+
+# a timeout keeps the waits of python 2 interruptible
+Forever = 365*24*3600
+
+def readAhead( fetch, depth=8 ):
+    """
+    yield the rows of the batches of fetch() up to the first empty one, fetched by a thread
+    :param fetch: returns the next list of rows, e.g. cursor.fetchmany
+    :param depth: number of batches fetched ahead
+    """
+    queue = Queue.Queue(depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, True, 0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            rows = fetch()
+            while rows and put(('rows', rows)):
+                rows = fetch()
+            put(('done', None))
+        except Exception:
+            put(('error', sys.exc_info()))
+
+    thread = threading.Thread(target=read)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            kind, value = queue.get(True, Forever)
+            if kind == 'rows':
+                for row in value:
+                    yield row
+            elif kind == 'error':
+                raise value[0], value[1], value[2]
+            else:
+                break
+    finally:
+        # also when the consumer stops early, the cursor is free again once the thread is gone
+        stop.set()
+        thread.join()
+
+
+class PendingPage(object):
+    """
+    A page file collected piece by piece, handed to the writer on close
+    """
+    def __init__(self, writer, filename):
+        self.writer = writer
+        self.filename = filename
+        self.pieces = []
+
+    def write(self, piece):
+        self.pieces.append(piece)
+
+    def close(self):
+        self.writer.write(self.filename, self.pieces)
+        self.pieces = None
+
+
+class PageWriter(object):
+    """
+    The writer thread of the exported pages, write() blocks while depth pages are waiting
+    """
+    def __init__(self, depth=4):
+        self.queue = Queue.Queue(depth)
+        self.bytes = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # a file object for the page, written by the thread once closed
+    def open(self, filename):
+        return PendingPage(self, filename)
+
+    def write(self, filename, pieces):
+        self._raise()
+        self.queue.put((filename, pieces), True, Forever)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            filename, pieces = item
+            try:
+                data = u''.join(pieces).encode('utf-8')
+                fid = open(filename, 'wb')
+                fid.write(data)
+                fid.close()
+                self.bytes += len(data)
+            except Exception:
+                self.error = sys.exc_info()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error[0], error[1], error[2]
+
+    # wait for the pages left, the first failed write is raised here or by the next write()
+    def close(self):
+        self.queue.put(None, True, Forever)
+        while self.thread.is_alive():
+            self.thread.join(Forever)
+        self._raise()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+The MIT License (MIT)
+
+Copyright (c) 2014 Jianxia Xue xuejianxia@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+timing and counters of an export run
+
+The stages are timed by wrapping the methods of one exporter instance, so a disabled profiler
+leaves the methods untouched, and the counters of a disabled profiler are calls doing nothing,
+made per statement, page or message with a payload or an attachment, never per text message.
+"""
+import time, json, functools
+
+class Profiler(object):
+    """
+    The registry of the stage timers, the counters and the latency of the exported pages
+    """
+    enabled = True
+
+    def __init__(self):
+        self.timers = {}   # stage: [calls, seconds, max seconds]
+        self.counters = {} # name: count
+        self.periods = []  # seconds spent on every exported page
+        self.mark = None
+
+    # time every call of the given methods of obj, under the stage names prefix+method
+    def instrument(self, obj, methods, prefix=''):
+        for name in methods:
+            setattr(obj, name, self._timed(prefix+name, getattr(obj, name)))
+
+    def _timed(self, stage, method):
+        timers = self.timers
+        @functools.wraps(method)
+        def timed(*args, **kw):
+            t = time.time()
+            try:
+                return method(*args, **kw)
+            finally:
+                dt = time.time()-t
+                timer = timers.get(stage)
+                if timer is None:
+                    timer = timers[stage] = [0, 0.0, 0.0]
+                timer[0] += 1
+                timer[1] += dt
+                if dt > timer[2]:
+                    timer[2] = dt
+        return timed
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0)+n
+
+    # the time since the former page, or since the start of the export
+    def period(self):
+        now = time.time()
+        if self.mark is not None:
+            self.periods.append(now-self.mark)
+        self.mark = now
+
+    def start(self):
+        self.mark = time.time()
+
+    # the raw registry, to be merged into the profiler of the parent process
+    def export(self):
+        return {'timers': self.timers, 'counters': self.counters, 'periods': self.periods}
+
+    def merge(self, data):
+        for stage, (calls, seconds, longest) in data['timers'].iteritems():
+            timer = self.timers.setdefault(stage, [0, 0.0, 0.0])
+            timer[0] += calls
+            timer[1] += seconds
+            timer[2] = max(timer[2], longest)
+        for name, n in data['counters'].iteritems():
+            self.count(name, n)
+        self.periods.extend(data['periods'])
+
+    def summary(self):
+        stages = {}
+        for stage, (calls, seconds, longest) in self.timers.iteritems():
+            stages[stage] = {'calls': calls, 'seconds': round(seconds, 6), 'max': round(longest, 6)}
+        periods = sorted(self.periods)
+        latency = {'pages': len(periods)}
+        if periods:
+            n = len(periods)
+            latency.update({'mean': round(sum(periods)/n, 6), 'p50': round(periods[n/2], 6),
+                            'p95': round(periods[min(n-1, n*95/100)], 6), 'max': round(periods[-1], 6)})
+        return {'stages': stages, 'counters': self.counters, 'pageLatency': latency}
+
+    def save(self, filename):
+        fid = open(filename, 'w')
+        fid.write(json.dumps(self.summary(), indent=1, sort_keys=True))
+        fid.close()
+
+
+class NullProfiler(object):
+    """
+    The disabled profiler, every call does nothing
+    """
+    enabled = False
+
+    def instrument(self, obj, methods, prefix=''):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def period(self):
+        pass
+
+    def start(self):
+        pass
+
+    def export(self):
+        return None
+
+    def merge(self, data):
+        pass
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+The MIT License (MIT)
+
+Copyright (c) 2014 Jianxia Xue xuejianxia@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+full text search of the chat archive: the text of the exported records is cut into ascii words
+and CJK unigrams and bigrams, and written either as postings sharded by token for the static
+viewer (js/gssbSearch.js mirrors the tokenizer and the shard hash) or into an FTS5 sidecar database
+
+usage of the sidecar: python chat_search.py html/search.sqlite "query"
+"""
+import re, os, sys, codecs, json, sqlite3
+from HTMLParser import HTMLParser
+
+"""
+ Tokenization, kept in sync with js/gssbSearch.js
+"""
+CJKChars = u'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+TokenPattern = re.compile(u'([%s]+)|([0-9a-z]+)' % CJKChars)
+TagPattern = re.compile(r'<[^>]*>')
+EntityParser = HTMLParser()
+
+# the plain text of a rendered message, with the markup of the message templates removed
+def plainText( html ):
+    return EntityParser.unescape(TagPattern.sub(' ', html))
+
+# the distinct tokens of a text: lower case ascii words, CJK unigrams and bigrams
+def tokenize( text ):
+    tokens = set()
+    for cjk, word in TokenPattern.findall(text.lower()):
+        if word:
+            tokens.add(word)
+            continue
+        for i in range(len(cjk)):
+            tokens.add(cjk[i])
+            if i+1 < len(cjk):
+                tokens.add(cjk[i:i+2])
+    return tokens
+
+# the shard of a token, the same 32 bit string hash as gssbSearch.js
+def tokenShard( token, shards ):
+    h = 0
+    for c in token:
+        h = (h*31+ord(c)) & 0xffffffff
+    return h % shards
+
+
+class SearchIndex(object):
+    """
+    Postings of the records exported in one run, keyed by day so that the days exported again
+    replace their former postings when merged into the index on disk
+    """
+    # only texts and links carry searchable text
+    indexedTypes = (1, 49)
+
+    def __init__(self):
+        self.documents = [] # (day, record id, speaker, plain text), the record id is its MesLocalID
+        self.cleared = set() # days exported without records
+
+    def addRecords(self, day, records):
+        for item in records:
+            if item.msgtype in self.indexedTypes:
+                self.documents.append((day, item.msgid, item.speaker, plainText(item.msg)))
+
+    # the postings of a day left without records are dropped too
+    def clearDay(self, day):
+        self.cleared.add(day)
+
+    def extend(self, other):
+        self.documents.extend(other.documents)
+        self.cleared.update(other.cleared)
+
+    def days(self):
+        return set([doc[0] for doc in self.documents]) | self.cleared
+
+    def saveShards(self, folder, shards=64):
+        """
+        write folder/meta.json, the sorted days and the shard count, and folder/<k>.json,
+        {token: [day index, record id, day index, record id, ...]} for the tokens of shard k
+        :param folder: the search folder below the html folder
+        :param shards: number of posting files, used again when the index on disk has another count
+        """
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        replaced = self.days()
+        postings = {}
+        metaFile = os.path.join(folder, 'meta.json')
+        if os.path.exists(metaFile):
+            meta = _loadJSON(metaFile)
+            for k in range(meta['shards']):
+                shardFile = os.path.join(folder, '%d.json' % k)
+                if not os.path.exists(shardFile):
+                    continue
+                for token, flat in _loadJSON(shardFile).iteritems():
+                    kept = [(meta['days'][flat[i]], flat[i+1]) for i in range(0, len(flat), 2)
+                            if meta['days'][flat[i]] not in replaced]
+                    if kept:
+                        postings[token] = kept
+        for day, recordID, speaker, text in self.documents:
+            for token in tokenize(text):
+                postings.setdefault(token, []).append((day, recordID))
+
+        days = sorted(set([day for entries in postings.itervalues() for day, recordID in entries]))
+        dayIndex = dict([(day, i) for i, day in enumerate(days)])
+        files = [{} for k in range(shards)]
+        for token, entries in postings.iteritems():
+            entries.sort()
+            flat = []
+            for day, recordID in entries:
+                flat.append(dayIndex[day])
+                flat.append(recordID)
+            files[tokenShard(token, shards)][token] = flat
+        for k in range(shards):
+            _saveJSON(os.path.join(folder, '%d.json' % k), files[k])
+        _saveJSON(metaFile, {'shards': shards, 'days': days, 'tokens': len(postings)})
+        return len(postings)
+
+    def saveSidecar(self, dbFile):
+        """
+        write the records into the FTS5 table search of dbFile, the text goes in unindexed and
+        its tokens space separated into the indexed grams column
+        """
+        con = sqlite3.connect(dbFile)
+        con.execute('''create virtual table if not exists search using fts5(
+                       day unindexed, id unindexed, speaker unindexed, body unindexed, grams)''')
+        con.executemany('''delete from search where day = ?''', [(day,) for day in self.days()])
+        con.executemany('''insert into search(day, id, speaker, body, grams) values (?, ?, ?, ?, ?)''',
+                        [(day, recordID, speaker, text, ' '.join(tokenize(text)))
+                         for day, recordID, speaker, text in self.documents])
+        con.commit()
+        con.close()
+        return len(self.documents)
+
+
+# the (day, record id, speaker, text) of the sidecar records containing the query
+def searchSidecar( dbFile, query ):
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    match = ' '.join(['"%s"' % token for token in tokens])
+    con = sqlite3.connect(dbFile)
+    rows = con.execute('''select day, id, speaker, body from search where grams match ? order by day, id''',
+                       (match,)).fetchall()
+    con.close()
+    # the n-grams only narrow down the candidates
+    query = query.lower()
+    return [row for row in rows if query in row[3].lower()]
+
+def _loadJSON( filename ):
+    fid = codecs.open(filename, "r", encoding="utf-8")
+    data = json.load(fid)
+    fid.close()
+    return data
+
+def _saveJSON( filename, data ):
+    fid = codecs.open(filename, "w", encoding="utf-8")
+    fid.write(json.dumps(data, separators=(',', ':')))
+    fid.close()
+
+
+if __name__ == "__main__":
+    for day, recordID, speaker, body in searchSidecar(sys.argv[1], sys.argv[2].decode('utf-8')):
+        print ("%s %s %s: %s" % (day, recordID, speaker, body)).encode('utf-8')
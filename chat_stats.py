@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+The MIT License (MIT)
+
+Copyright (c) 2014 Jianxia Xue xuejianxia@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+the statistics cube of the chat tables: the message count per day, type and speaker, kept in a
+sidecar sqlite database, so the statistics of any range of days are summed from the day buckets
+instead of reading the messages again
+
+The speaker graph of every day is kept the same way: the links of the messages to the speakers
+active earlier that day, and apart from them the links to the speakers active at the end of the
+day before, which only count when that day is in the range too. With the last message time of
+every speaker per day, the graph of any range of days is the sum of its day buckets.
+
+The exporter adds the messages with an id above the last one counted, continuing from the
+speakers active at the end of the former update. A content signature of every day tells the days
+whose counted messages were edited in place, like a recalled message, or removed; the days from
+the first one changed on are counted again. The cube of a chat table is rebuilt when the day,
+speaker or graph settings changed; the graph links and last times are kept by nickname, so a
+renamed friend rebuilds the cube as well.
+"""
+import sqlite3, json
+
+Schema = ['''create table if not exists cube(chat text, day text, type integer, speaker text, count integer,
+              primary key(chat, day, type, speaker))''',
+          '''create table if not exists coverage(chat text primary key, maxId integer, rows integer, settings text)''',
+          '''create table if not exists links(chat text, day text, speaker text, other text, count integer,
+              cross integer, primary key(chat, day, speaker, other))''',
+          '''create table if not exists lastT(chat text, day text, speaker text, lastT integer,
+              primary key(chat, day, speaker))''',
+          '''create table if not exists boundary(chat text primary key, window text)''',
+          '''create table if not exists days(chat text, day text, signature text, primary key(chat, day))''']
+
+class StatCube(object):
+    """
+    The day buckets of the sidecar database, days are yyyy-mm-dd strings
+    """
+    def __init__(self, dbFile):
+        self.conn = sqlite3.connect(dbFile)
+        for sql in Schema:
+            self.conn.execute(sql)
+
+    # (max id, row count, settings) of the messages counted for the chat table, None before the first update
+    def state(self, chat):
+        return self.conn.execute('select maxId, rows, settings from coverage where chat = ?', (chat,)).fetchone()
+
+    # {speaker: last message time} of the speakers active at the end of the former update
+    def window(self, chat):
+        row = self.conn.execute('select window from boundary where chat = ?', (chat,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    # {day: content signature} of the days of the chat table as of the former update
+    def signatures(self, chat):
+        return dict(self.conn.execute('select day, signature from days where chat = ?', (chat,)))
+
+    def reset(self, chat):
+        for table in ('cube', 'coverage', 'links', 'lastT', 'boundary', 'days'):
+            self.conn.execute('delete from %s where chat = ?' % table, (chat,))
+
+    # drop the counts, links and last times of the days from firstDay on, to count them again
+    def rewind(self, chat, firstDay):
+        for table in ('cube', 'links', 'lastT'):
+            self.conn.execute('delete from %s where chat = ? and day >= ?' % table, (chat, firstDay))
+
+    def add(self, chat, counts, links, lastT, window, maxId, rows, settings, signatures):
+        """
+        add the counts and the graph links of new messages and record how far the chat table is counted
+        :param counts: {(day, type, speaker id): count}
+        :param links: {(day, speaker, other): [count, cross]}, cross the links to the day before
+        :param lastT: {(day, speaker): time of the last message}
+        :param window: {speaker: last message time} of the speakers active at the end
+        :param signatures: {day: content signature} of all days of the chat table
+        """
+        conn = self.conn
+        items = [(chat, day, msgtype, speaker, n) for (day, msgtype, speaker), n in counts.iteritems()]
+        conn.executemany('insert or ignore into cube values (?, ?, ?, ?, 0)', [item[:4] for item in items])
+        conn.executemany('''update cube set count = count + ? where chat = ? and day = ? and type = ? and speaker = ?''',
+                         [item[4:]+item[:4] for item in items])
+        items = [(chat, day, speaker, other, n, cross) for (day, speaker, other), (n, cross) in links.iteritems()]
+        conn.executemany('insert or ignore into links values (?, ?, ?, ?, 0, 0)', [item[:4] for item in items])
+        conn.executemany('''update links set count = count + ?, cross = cross + ?
+                            where chat = ? and day = ? and speaker = ? and other = ?''',
+                         [item[4:]+item[:4] for item in items])
+        items = [(chat, day, speaker, t) for (day, speaker), t in lastT.iteritems()]
+        conn.executemany('insert or ignore into lastT values (?, ?, ?, ?)', items)
+        conn.executemany('''update lastT set lastT = max(lastT, ?) where chat = ? and day = ? and speaker = ?''',
+                         [item[3:]+item[:3] for item in items])
+        conn.execute('insert or replace into boundary values (?, ?)', (chat, json.dumps(window)))
+        conn.execute('insert or replace into coverage values (?, ?, ?, ?)', (chat, maxId, rows, settings))
+        conn.execute('delete from days where chat = ?', (chat,))
+        conn.executemany('insert into days values (?, ?, ?)',
+                         [(chat, day, signature) for day, signature in signatures.iteritems()])
+        conn.commit()
+
+    # {type: count} of the days [firstDay, stopDay)
+    def typeCount(self, chat, firstDay, stopDay):
+        return dict(self.conn.execute('''select type, sum(count) from cube where chat = ? and day >= ? and day < ?
+                                         group by type''', (chat, firstDay, stopDay)))
+
+    # {speaker: count} of the days [firstDay, stopDay)
+    def speakerCount(self, chat, firstDay, stopDay):
+        return dict(self.conn.execute('''select speaker, sum(count) from cube where chat = ? and day >= ? and day < ?
+                                         group by speaker''', (chat, firstDay, stopDay)))
+
+    # {(speaker, other): count} of the speaker graph of the days [firstDay, stopDay)
+    def graph(self, chat, firstDay, stopDay):
+        rows = self.conn.execute('''select speaker, other, sum(count) + sum(case when day > ? then cross else 0 end)
+                                    from links where chat = ? and day >= ? and day < ? group by speaker, other''',
+                                 (firstDay, chat, firstDay, stopDay))
+        return dict([((speaker, other), n) for speaker, other, n in rows if n])
+
+    # {speaker: time of the last message} of the days [firstDay, stopDay)
+    def lastTimes(self, chat, firstDay, stopDay):
+        return dict(self.conn.execute('''select speaker, max(lastT) from lastT where chat = ? and day >= ? and day < ?
+                                         group by speaker''', (chat, firstDay, stopDay)))
+
+    def close(self):
+        self.conn.close()
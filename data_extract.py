@@ -115,52 +115,289 @@ created: 20140521
 """
 import sqlite3
 import time, datetime, calendar
-import sys, operator, glob, os.path
+import sys, operator, os.path, shutil, re, errno, urllib
 import xml.etree.ElementTree as ET
 from lxml import etree
-import codecs, json, inspect
+import codecs, json, inspect, hashlib, array, collections, gzip
+import argparse, multiprocessing, functools
+
+from chat_calendar import (DailyTimestampStep, str2epoch, epoch2str, minute_distance,
+                           isMonthlyStart, isWeeklyStart, nextMonth, nextWeek, zoneSignature, ExportCalendar)
+from chat_search import SearchIndex
+from chat_profile import Profiler, NullProfiler
+from chat_stats import StatCube
+from chat_pipeline import readAhead, PageWriter
+from chat_cache import RenderCache
+import chat_media
+
+"""
+ Read-only connections: python 2 has no sqlite3.connect(uri=True), the file: uris are read when the
+ sqlite library is built with SQLITE_USE_URI, otherwise the connection only gets query_only
+"""
+SQLiteURI = any([row[0].startswith('USE_URI') for row in
+                 sqlite3.connect(':memory:').execute('pragma compile_options')])
+
+def connectReadOnly( dbFile, immutable=False, mmapSize=0, cacheSize=0, threads=False ):
+    """
+    :param immutable: skip all locking and change detection, for a file nothing writes to while connected
+    :param threads: allow the connection to be used by other threads than its own, one at a time
+    :param mmapSize: bytes of the file read through memory mapping
+    :param cacheSize: KiB of the page cache
+    """
+    if not os.path.exists(dbFile):
+        # sqlite3.connect would create an empty database
+        raise IOError(errno.ENOENT, 'no such database', dbFile)
+    if SQLiteURI:
+        conn = sqlite3.connect('file:%s?mode=ro%s' % (urllib.quote(os.path.abspath(dbFile)),
+                                                      '&immutable=1' if immutable else ''),
+                               check_same_thread=not threads)
+    else:
+        conn = sqlite3.connect(dbFile, check_same_thread=not threads)
+    conn.execute('pragma query_only = 1')
+    if mmapSize:
+        conn.execute('pragma mmap_size = %d' % mmapSize)
+    if cacheSize:
+        conn.execute('pragma cache_size = -%d' % cacheSize)
+    return conn
 
 """
- Timestamp related conversions
+ Fast path for the <msg><tag attr="value" ... /></msg> payloads (emoji, location, video),
+ read with regular expressions instead of building an element tree
 """
-DailyTimestampStep = 24*3600;
-
-def str2epoch( yyyy_mm_dd ):
-    return int(time.mktime(datetime.datetime.strptime(yyyy_mm_dd,"%Y-%m-%d").timetuple()))
-
-def epoch2str( timestamp ):
-    return time.strftime('%Y-%m-%d', time.localtime(float(timestamp)))
-# return the timestamp difference in munites
-def minute_distance( tstamp1, tstamp2 ):
-    d = datetime.timedelta(seconds = tstamp2-tstamp1)
-    return d.minutes
-# return true if the timestamp is on the first day of a month
-def isMonthlyStart( timestamp ):
-    t = time.localtime(float(timestamp));
-    return t[2] == 1
-# return true if the timestamp is on a Monday as the beginning of a week
-def isWeeklyStart( timestamp ):
-    t = time.localtime(float(timestamp));
-    d = datetime.date(t[0], t[1], t[2])
-    return d.isoweekday()==1
-# return the timestamp of the begining of the following month from the given timestamp month
-def nextMonth( timestamp ):
-    t = time.localtime(float(timestamp));
-    y = t[0]
-    m = t[1]+1
-    if m == 13:
-        m = 1
-        y += 1    
-    return int(time.mktime([y, m, 1, 0, 0, 0, 0, 0, 0]))
-# return the timestamp of the begining of the following week from the given timestamp week
-def nextWeek( timestamp ):
-    t = time.localtime(float(timestamp));
-    y = t[0]
-    d = datetime.date(t[0], t[1], t[2])
-    diso = d.isocalendar()
-    d1 = d-datetime.timedelta(days=(diso[2]-1))    
-    d2 = d1+datetime.timedelta(weeks=1)
-    return int(time.mktime(d2.timetuple()))
+PayloadPattern = re.compile(r'''^\s*(?:<\?xml[^>]*\?>\s*)?<msg>\s*<([\w:]+)((?:\s+[\w:]+\s*=\s*(?:"[^"<]*"|'[^'<]*'))*)\s*(?:/>|>\s*</\1>)\s*</msg>\s*$''')
+AttributePattern = re.compile(r'''([\w:]+)\s*=\s*(?:"([^"<]*)"|'([^'<]*)')''')
+EntityPattern = re.compile(r'&(?:(amp|lt|gt|quot|apos)|#([0-9]+)|#x([0-9a-fA-F]+));')
+XMLEntities = {'amp': u'&', 'lt': u'<', 'gt': u'>', 'quot': u'"', 'apos': u"'"}
+
+def _xmlEntity( match ):
+    name, dec, hexa = match.groups()
+    if name is not None:
+        return XMLEntities[name]
+    return unichr(int(dec)) if dec is not None else unichr(int(hexa, 16))
+
+# return (tag, attributes) of the only child of <msg>, None when the payload needs the full parser
+def parseSimplePayload( msg ):
+    m = PayloadPattern.match(msg)
+    if m is None:
+        return None
+    attrib = {}
+    for name, value1, value2 in AttributePattern.findall(m.group(2)):
+        value = value1 or value2
+        # whitespace normalization and unusual references are left to the xml parser
+        if '\t' in value or '\n' in value or '\r' in value:
+            return None
+        if '&' in value:
+            if value.count('&') != len(EntityPattern.findall(value)):
+                return None
+            value = EntityPattern.sub(_xmlEntity, value)
+        attrib[name] = value
+    return m.group(1), attrib
+
+
+class MessageRecord(object):
+    """
+    One message, or several adjacent messages of the same speaker and type bound together.
+    The bound bodies are kept as a list and joined once when the message is read, msgid is
+    the MesLocalID of the first message.
+    """
+    __slots__ = ('timestamp', 'speaker', 'msgtype', 'body', 'msgid')
+    # the longest gap between two messages bound into one record, in seconds
+    bindWindow = 10*60
+
+    def __init__(self, timestamp, speaker, msgtype, msg, msgid=None):
+        self.timestamp = timestamp
+        self.speaker = speaker
+        self.msgtype = msgtype
+        self.body = msg
+        self.msgid = msgid
+
+    def append(self, msg):
+        if type(self.body) is list:
+            self.body.append(msg)
+        else:
+            self.body = [self.body, msg]
+
+    @property
+    def msg(self):
+        if type(self.body) is list:
+            self.body = "; ".join(self.body)
+        return self.body
+
+    def toList(self):
+        return [self.timestamp, self.speaker, self.msgtype, self.msg]
+
+    # the former [timestamp, speaker, msgtype, msg] list layout stays readable by index
+    def __getitem__(self, index):
+        return self.toList()[index]
+
+    def __len__(self):
+        return 4
+
+# bind adjacent messages of the same speaker and type less than MessageRecord.bindWindow apart,
+# messages are (timestamp, speaker, msgtype, rendered message, msgid) in time order,
+# every record is yielded once no later message binds to it
+def bindRecords( messages ):
+    window = MessageRecord.bindWindow
+    current = None
+    previousTimestamp = 0
+    for timestamp, speaker, msgtype, msg, msgid in messages:
+        if (current is not None and speaker == current.speaker and
+            timestamp-previousTimestamp < window and msgtype == current.msgtype):
+            current.append(msg)
+        else:
+            if current is not None:
+                yield current
+            current = MessageRecord(timestamp, speaker, msgtype, msg, msgid)
+        previousTimestamp = timestamp
+    if current is not None:
+        yield current
+
+
+class LinkMatrix(object):
+    """
+    The n x n speaker adjacency counts in one flat integer array, turned into lists for json
+    """
+    __slots__ = ('n', 'data')
+
+    def __init__(self, n):
+        self.n = n
+        self.data = array.array('l', [0])*(n*n)
+
+    def add(self, source, target, count=1):
+        self.data[source*self.n+target] += count
+
+    def tolist(self):
+        n = self.n
+        data = self.data
+        return [data[i*n:(i+1)*n].tolist() for i in xrange(n)]
+
+
+class RecentSpeakers(object):
+    """
+    The speakers whose last message falls within the time window T, oldest first. A new message
+    only visits these recently active speakers instead of every node of the speaker graph.
+    """
+    def __init__(self, T):
+        self.T = T
+        self.lastT = {}  # time of the last message of every speaker seen
+        self.recent = collections.OrderedDict()
+        self.latest = None
+
+    def update(self, speaker, timestamp):
+        """
+        return the other speakers who spoke less than T before timestamp, then record the message
+        """
+        T = self.T
+        recent = self.recent
+        if self.latest is None or timestamp >= self.latest:
+            self.latest = timestamp
+            # expire from the oldest, they cannot come back as the time only moves forward
+            while recent:
+                name, lastT = next(recent.iteritems())
+                if timestamp - lastT < T:
+                    break
+                del recent[name]
+            candidates = recent.iteritems()
+        else:
+            # a message out of time order, check every speaker as the expired ones may count again
+            candidates = self.lastT.iteritems()
+        active = [name for name, lastT in candidates if name != speaker and timestamp - lastT < T]
+        recent.pop(speaker, None)
+        recent[speaker] = timestamp
+        self.lastT[speaker] = timestamp
+        return active
+
+    # {speaker: last message time} of the recently active speakers, to resume from with resume()
+    def active(self):
+        return dict(self.recent)
+
+    def resume(self, active):
+        for name, lastT in sorted(active.iteritems(), key=operator.itemgetter(1)):
+            self.recent[name] = lastT
+            self.lastT[name] = lastT
+            self.latest = lastT
+
+
+class PeriodAccumulator:
+    """
+    Collects the statistics, the speaker graph and optionally the merged records of one
+    daily/weekly/monthly period, fed message by message from a single scan of the chat table
+    """
+    # the attributes loaded into the exporter for the stat/record/graph exports
+    fields = ('startTime', 'stopTime', 'queryName', 'statType', 'messageTotal', 'messageStat',
+              'speakers', 'speakerStat', 'speakerGraph', 'records')
+
+    def __init__(self, exporter, start, stop, withRecords=False):
+        """
+        :param exporter: the Chat2HTML_EXPORTER whose current period (names and times) is captured
+        :param start, stop: the biased timestamp range [start, stop) of the period
+        :param withRecords: merge the rendered messages into records, only needed for exported pages
+        """
+        self.startTime = exporter.startTime
+        self.stopTime = exporter.stopTime
+        self.queryName = exporter.queryName
+        self.statType = exporter.statType
+        self.start = start
+        self.stop = stop
+        self.withRecords = withRecords
+        self.closed = False
+
+        self.messageTotal = 0
+        self.typeCount = {}
+        self.speakerCount = {}
+        self.window = RecentSpeakers(exporter.minute_thresh * 60)
+        self.links = {}
+        # the rendered messages, bound into records when closing
+        self.messages = []
+        self.records = []
+
+    def add(self, usr, speaker, timestamp, msgtype, msg, msgid=None):
+        self.messageTotal += 1
+        self.typeCount[msgtype] = self.typeCount.get(msgtype, 0)+1
+        self.speakerCount[usr] = self.speakerCount.get(usr, 0)+1
+
+        # speaker graph, filtered down to the counted speakers when closing
+        for name in self.window.update(speaker, timestamp):
+            key = (speaker, name)
+            self.links[key] = self.links.get(key, 0)+1
+
+        if self.withRecords:
+            self.messages.append((timestamp, speaker, msgtype, msg, msgid))
+
+    def close(self, nicknames, msgTypes):
+        """
+        :param nicknames: UsrName to NickName dictionary covering all counted speakers
+        :param msgTypes: the message type dictionary of the exporter
+        """
+        stat = {}
+        for key, value in msgTypes.iteritems():
+            stat[key] = self.typeCount.get(int(key), 0)
+        self.messageStat = sorted(stat.iteritems(), key=operator.itemgetter(1), reverse=True)
+
+        speakers = self.speakerCount
+        speakerActivity = {}
+        for key in speakers:
+            nickname = nicknames[key]
+            speakerActivity[nickname] = speakers[key]
+            speakers[key] = nickname
+        self.speakers = speakers
+        self.speakerStat = sorted(speakerActivity.iteritems(), key=operator.itemgetter(1), reverse=True)
+
+        nodes = []
+        nameDict = {}
+        lastT = self.window.lastT
+        for index, (key, value) in enumerate(self.speakerStat):
+            nodes.append({'name': key, 'r': value, 'lastT': lastT.get(key, -1000000), 'index': index})
+            nameDict[key] = index
+        n = len(speakers)
+        links = LinkMatrix(n)
+        for (source, target), count in self.links.iteritems():
+            if nameDict.has_key(source) and nameDict.has_key(target):
+                links.add(nameDict[source], nameDict[target], count)
+        self.speakerGraph = {"nodes": nodes, "links": links, "nameDict": nameDict}
+        self.records = list(bindRecords(self.messages))
+        self.typeCount = self.speakerCount = self.window = self.links = self.messages = None
+        self.closed = True
     
 
 class Chat2HTML_EXPORTER:
@@ -171,7 +408,11 @@ class Chat2HTML_EXPORTER:
     def __init__(self, dbFolder="DB_20140526/", htmlFolder = "html/", 
                  Chat_Table = 'Chat_28228f7a9f1a43c84f9045374383c8a4', # hardcoded now for gssb
                  dataProvider='xue', dataProviderID='wxid_mknhwpgccdz312', 
-                 timestamp_bias=13*60*60, minute_thresh = 1):
+                 timestamp_bias=13*60*60, minute_thresh = 1,
+                 indexedDB=None, explainQueries=False, friendCache=None, attachmentCache=None,
+                 sharded=False, searchIndex=None, profile=False,
+                 mmapSize=256*1024*1024, cacheSize=64*1024, fetchSize=1024, statCube=None,
+                 pipeline=False, renderCache=False, assetFolder=''):
         """
         Configuration including database file
         :param dbFolder: the input folder that contains the sqlite database and corresponding attachment data, imported from smart phone
@@ -182,14 +423,60 @@ class Chat2HTML_EXPORTER:
 
         :timestamp_bias: this bias will be added to the final presentation of the timestamp
         :minute_thresh: this is the minimum temporal difference between two speakers to be considered having real-time conversation
+
+        :indexedDB: optional path of a working copy of MM.sqlite with an index on CreateTime,
+                    the copy is refreshed whenever the original is newer, the original is never modified
+        :explainQueries: print the sqlite query plan of every distinct query once
+        :friendCache: optional json file keeping the Friend nicknames between runs,
+                      it is reused as long as the modification time of MM.sqlite is unchanged
+        :attachmentCache: optional json file keeping the attachment folder listings between runs,
+                          a folder is listed again when its modification time changed
+        :sharded: write every day as a json shard under json/ plus one viewer page index.html,
+                  instead of a standalone html page per day
+        :searchIndex: 'shards' to index the text and link messages of the exported days into the
+                      postings under search/ with the page search.html, 'fts5' to index them into
+                      the sidecar database search.sqlite, None for no search index
+        :profile: time the stages and count the statements, rows, payloads, attachment lookups
+                  and bytes written, see profiler.summary()
+        :mmapSize: bytes of MM.sqlite read through memory mapping, 0 to read it with system calls
+        :cacheSize: KiB of the sqlite page cache
+        :fetchSize: rows fetched at a time from the message queries
+        :statCube: optional path of the sidecar database with the message count per day, type and
+                   speaker, brought up to date on use, the weekly and monthly stats are summed from it
+        :pipeline: export the days with a reader thread fetching the rows of the single scan ahead
+                   and a writer thread writing the pages behind the rendering, see chat_pipeline.py
+        :renderCache: keep the rendered links and emotions in render.sqlite under htmlFolder between
+                      periods and runs, see chat_cache.py
+        :assetFolder: the folder of js/ and style/ relative to htmlFolder, '../' for the conversation
+                      folders of saveAllArchives
         """
         self.dbFolder = dbFolder
         self.htmlFolder =htmlFolder
+        self.assetFolder = assetFolder
+        self.htmlTemplate = self.htmlTemplate.replace('{assets}', assetFolder)
+        self.searchPageTemplate = self.searchPageTemplate.replace('{assets}', assetFolder)
         self.Chat_Table = Chat_Table;
         self.dataProvider = dataProvider
         self.dataProviderID = dataProviderID
         self.time_bias = timestamp_bias
+        # all conversions between CreateTime and the biased timestamps go through the calendar
+        self.calendar = ExportCalendar(timestamp_bias)
         self.minute_thresh = minute_thresh # this is the maximum temporal distance to consider if any two speakers chat together
+        self.indexedDB = indexedDB
+        self.explainQueries = explainQueries
+        self.explainedQueries = set()
+        self.friendCache = friendCache
+        # UsrName to NickName dictionary of the whole Friend table, loaded once
+        self.nicknames = None
+        self.attachmentCache = attachmentCache
+        # listing of the attachment folders, loaded once
+        self.attachments = None
+        self.sharded = sharded
+        self.searchIndex = searchIndex
+        # the records of the exported days, written to the search index at the end of the export
+        self.search = None if searchIndex is None else SearchIndex()
+        # least recently used cache of decoded xml payloads
+        self.payloadCache = collections.OrderedDict()
     
         # query related dyanmic data
         self.startTime = None
@@ -202,6 +489,36 @@ class Chat2HTML_EXPORTER:
         # query results that can contain multiply query statistics
         self.speakerGraphs = None
         self.stats = None
+        # per-day message type counts prefetched for a whole export range
+        self.statBuckets = None
+        # (filename, message count) of the pages written by exportHTML or exportShard
+        self.exported = []
+
+        # the database is only ever read
+        self.mmapSize = mmapSize
+        self.cacheSize = cacheSize
+        self.fetchSize = fetchSize
+        self.statCube = statCube
+        # the open StatCube of statCube
+        self.cube = None
+        self.pipeline = pipeline
+        # the PageWriter of the pages while a pipelined export runs
+        self.writer = None
+        self.renderCache = renderCache
+        # the open RenderCache of renderCache
+        self.rendered = None
+
+        self.profile = profile
+        self.profiler = NullProfiler()
+        if profile:
+            self.profiler = Profiler()
+            self.profiler.instrument(self, self.ProfiledStages)
+
+    # the methods timed by the profiler, the time of a stage includes the stages it calls
+    ProfiledStages = ('_loadFriends', '_loadAttachments', '_planIncremental', '_prefetchStatBuckets',
+                      'getMessageStat', 'getSpeakerInfo', 'getMessages', '_updateSpeakerGraph',
+                      'processMessage', '_decodePayload', '_ensembleSpeakerGraph', '_dispatchMessage',
+                      '_exportPage', 'exportHTML', 'exportShard', 'saveShardIndex', 'saveSearchIndex')
 
     """
     hard-coded input file and message structure
@@ -223,15 +540,27 @@ class Chat2HTML_EXPORTER:
     """
     hard-code database query patterns
     """
-    # hardcoded column index
-    Items = {'MsgLocalID': 1, 'CreateTime': 3, 'Message': 4, 'Status': 5, 'Type': 7};    
+    # the columns of the message queries and their index in the rows
+    Items = {'MsgLocalID': 0, 'CreateTime': 1, 'Message': 2, 'Status': 3, 'Type': 4};    
     # query strings with hard coded dependencies of MM.sqlite table names
     SQL_Templates = {
     "get_chatroom_name": '''select name from sqlite_sequence where seq = (select max(seq)  from sqlite_sequence)''',
-    "check_friend_nickname": '''select NickName from Friend where UsrName == "%s"''',    
+    "get_friend_nicknames": '''select UsrName, NickName from Friend''',
     "count_messages": '''select count(*) from %s where %s''',
-    "get_messages": '''select * from %s where %s''',
-    "get_messages_where": '''CreateTime >= %d and CreateTime < %d'''
+    "count_messages_by_type": '''select Type, count(*) from %s where %s group by Type''',
+    "count_messages_by_day": '''select (CreateTime-?)/?, Type, count(*) from %s where %s group by 1, 2''',
+    "get_messages": '''select MesLocalID, CreateTime, Message, Status, Type from %s where %s order by CreateTime, rowid''',
+    "get_messages_where": '''CreateTime >= ? and CreateTime < ?''',
+    "create_time_index": '''create index if not exists %s_Time on %s(CreateTime)''',
+    "drop_type_index": '''drop index if exists %s_CreateTime''',
+    "list_chat_tables": '''select name from sqlite_master where type = 'table' and name glob 'Chat_*' order by name''',
+    "count_rows": '''select count(*) from %s''',
+    "count_quarter_content": '''select (CreateTime+?)/900, MesLocalID <= ?, count(*), total(Type), total(Status), total(length(Message))
+                                  from %s group by 1, 2''',
+    "get_messages_after": '''select MesLocalID, CreateTime, Message, Status, Type from %s where MesLocalID > ? order by CreateTime, rowid''',
+    "get_messages_since": '''select MesLocalID, CreateTime, Message, Status, Type from %s where CreateTime >= ? or MesLocalID > ? order by CreateTime, rowid''',
+    "get_media_messages": '''select MesLocalID, Type, Message from %s where %s and Type in (3, 43, 47, 49)''',
+    "explain": '''explain query plan %s'''
     }
     
     """
@@ -245,13 +574,13 @@ class Chat2HTML_EXPORTER:
     <title>GSSB WeChat Message Archive</title>
     <meta name="author" content="Jianxia Xue">
     <meta name="create date" content="%s">
-    <link rel="stylesheet" type="text/css" href="style/gssb.css">
-    <script type="text/javascript" src="js/jquery-1.11.1.min.js"></script>
-    <script src="js/jquery-ui-1.10.4.custom.min.js"></script>
-    <link rel="stylesheet" href="style/jquery-ui-1.10.4.custom.min.css">
-    <script type="text/javascript" src="js/gssb.js"></script>    
-    <script type="text/javascript" src="js/d3.v3.min.js"></script>
-    <script src="js/gssbSpeakerGraph.js"></script>
+    <link rel="stylesheet" type="text/css" href="{assets}style/gssb.css">
+    <script type="text/javascript" src="{assets}js/jquery-1.11.1.min.js"></script>
+    <script src="{assets}js/jquery-ui-1.10.4.custom.min.js"></script>
+    <link rel="stylesheet" href="{assets}style/jquery-ui-1.10.4.custom.min.css">
+    <script type="text/javascript" src="{assets}js/gssb.js"></script>    
+    <script type="text/javascript" src="{assets}js/d3.v3.min.js"></script>
+    <script src="{assets}js/gssbSpeakerGraph.js"></script>
     <script>
     speakerGraphs = %s;
     </script>
@@ -271,6 +600,19 @@ class Chat2HTML_EXPORTER:
     <div class="monthlySG"></div>
     <div class="weeklySG"></div>
     '''
+
+    # body of the viewer page of the sharded archive, filled by gssb.js from the shards
+    shardViewerTemplate = '''<div id="archive">
+    <div id="datepicker"></div>
+    <div class="statArea"></div>
+    <div class="records"></div></div>
+    <div class="dailySG"></div>
+    <div class="monthlySG"></div>
+    <div class="weeklySG"></div>
+    <script>
+    shardIndex = "%s";
+    </script>
+    '''
     
     statTemplate = '''
     <div class="stat" class="%s">
@@ -283,7 +625,7 @@ class Chat2HTML_EXPORTER:
     typeStatTemplate = '''<div class="typeData">%d <span class="typeShow" msgtype="%s">%s</span></div>'''
     speakerStatTemplate = '''<div class="speakerData"><span class="speakerShow">%s</span> %d</div>'''
 
-    messageTemplate = '''<div class="message" id="%s" speaker="%s" msgtype="%s"><div class="timestamp">%s</div><span class="speakerShow">%s</span><span class="content">%s</span></div>'''
+    messageTemplate = '''<div class="message" id="%s" msgid="%s" speaker="%s" msgtype="%s"><div class="timestamp">%s</div><span class="speakerShow">%s</span><span class="content">%s</span></div>'''
 
     emojiMsgTemplate = '''<img height="80px" src="%s/%s.t.jpg" />'''
     unknownMsgTemplate = '''<span class="unknown">%s</span>'''
@@ -303,41 +645,85 @@ class Chat2HTML_EXPORTER:
         return {'monthly':None, 'weekly':None, 'daily':None, 'user':None};
     
     # collect message statistics
-    def getMessageStat(self, cursor, timeClause):
-        cur = cursor;
-        cur.execute(self.SQL_Templates['count_messages'] % (self.Chat_Table, timeClause))
-        data = cur.fetchone();
-        self.messageTotal =  0 if data is None else data[0]
+    def getMessageStat(self, cursor, timeClause, period=None):
+        typeCount = self._lookupStatBuckets(period)
+        if typeCount is None:
+            cur = cursor;
+            where, params = timeClause
+            self._execute(cur, self.SQL_Templates['count_messages_by_type'] % (self.Chat_Table, where), params)
+            typeCount = dict(cur.fetchall())
+            self.profiler.count('sql.rows', len(typeCount))
+        self._setMessageStat(typeCount)
+
+    def _setMessageStat(self, typeCount):
+        self.messageTotal = sum(typeCount.itervalues())
 
         stat = {}
         msgType = self.MsgType_dict
         for key, value in msgType.iteritems():
-            cur.execute("select count(*) from %s where %s and Type==%s" % (self.Chat_Table, timeClause, key))
-            data = cur.fetchone()
-            stat[key] = 0 if data is None else data[0]
+            stat[key] = typeCount.get(int(key), 0)
         self.messageStat = sorted(stat.iteritems(), key=operator.itemgetter(1), reverse=True);
 
+    # count messages per day and type for the whole range [a, b) with one query,
+    # so that any period aligned to the daily steps is summed up without rescanning
+    def _prefetchStatBuckets(self, cursor, a, b):
+        step = DailyTimestampStep
+        b = a + (b-a+step-1)/step*step
+        where, params = self._get_timeFrame_from_timestamp(a, b)
+        self._execute(cursor, self.SQL_Templates['count_messages_by_day'] % (self.Chat_Table, where),
+                      (self.calendar.unbiased(a), step)+params)
+        days = {}
+        rows = 0
+        for day, msgtype, count in cursor:
+            typeCount = days.setdefault(day, {})
+            typeCount[msgtype] = count
+            rows += 1
+        self.profiler.count('sql.rows', rows)
+        self.statBuckets = {'start': a, 'stop': b, 'days': days}
+
+    # sum up the prefetched daily counts of period (a, b), None if not covered
+    def _lookupStatBuckets(self, period):
+        buckets = self.statBuckets
+        if period is None or buckets is None:
+            return None
+        a, b = period
+        step = DailyTimestampStep
+        start = buckets['start']
+        if a < start or b > buckets['stop'] or (a-start)%step or (b-start)%step:
+            return None
+        typeCount = {}
+        days = buckets['days']
+        for day in xrange((a-start)/step, (b-start)/step):
+            for msgtype, count in days.get(day, {}).iteritems():
+                typeCount[msgtype] = typeCount.get(msgtype, 0) + count
+        return typeCount
+
     # collect speaker statistics
     def getSpeakerInfo(self, cursor, timeClause):
         cur = cursor;
-        cur.execute( self.SQL_Templates['get_messages'] % (self.Chat_Table, timeClause))
+        where, params = timeClause
+        self._execute(cur, self.SQL_Templates['get_messages'] % (self.Chat_Table, where), params)
         unlabeledSpeaker = self.dataProvider
         # build speaker dictionary
         speakers = {}
-        for row in cur:
+        for row in self._fetchRows(cur):
             msg = row[self.Items['Message']]            
             #parsing name
             parser = ':\n'
             idx = msg.find(parser)            
             speaker_id = unlabeledSpeaker if idx < 0 else msg[0:idx]
             speakers[speaker_id] = speakers.get(speaker_id,0)+1
+        self.profiler.count('sql.rows', sum(speakers.itervalues()))
+        self._setSpeakerStat(cur, speakers)
 
+    # the speaker dictionary and the sorted activity list from the message count of every speaker id
+    def _setSpeakerStat(self, cursor, speakers):
+        cur = cursor;
         # build speaker activity sorted list
+        self._loadFriends(cur)
         speakerActivity = {};
         for key in speakers:
-            cur.execute( self.SQL_Templates['check_friend_nickname'] % key);
-            data = cur.fetchone()
-            nickname = key if data is None else data[0]
+            nickname = self._lookupNickname(key)
             speakerActivity[nickname] = speakers[key]
             speakers[key] = nickname;            
         speakerActivity = sorted(speakerActivity.iteritems(), key=operator.itemgetter(1), reverse=True)
@@ -357,8 +743,9 @@ class Chat2HTML_EXPORTER:
             nodes.append({'name': key, 'r': value, 'lastT': -1000000, 'index': index});
             nameDict[key] = index
             index += 1
-        links = [[0 for x in xrange(n)] for x in xrange(n)]
-        self.speakerGraph = {"nodes": nodes, "links":links, "nameDict": nameDict}
+        links = LinkMatrix(n)
+        recent = RecentSpeakers(self.minute_thresh * 60)
+        self.speakerGraph = {"nodes": nodes, "links":links, "nameDict": nameDict, "recent": recent}
 
     def _updateSpeakerGraph(self, speaker, timestamp):        
         nodes = self.speakerGraph['nodes']
@@ -368,84 +755,116 @@ class Chat2HTML_EXPORTER:
             return None
 
         speakerIdx = d[speaker]
-        speakerNode = nodes[speakerIdx]
-        
-        T = self.minute_thresh * 60
-
-        for item in nodes:
-            if item['name'] == speaker:
-                continue
-
-            node = nodes[d[item['name']]]
-
-            if (timestamp - node['lastT'] ) < T:
-                source = speakerNode['index']
-                target = node['index']
-                self.speakerGraph['links'][source][target] += 1
+        links = self.speakerGraph['links']
+        # only the speakers active within minute_thresh are visited
+        for name in self.speakerGraph['recent'].update(speaker, timestamp):
+            links.add(speakerIdx, d[name])
                 
-        self.speakerGraph['nodes'][speakerIdx]['lastT'] = timestamp
+        nodes[speakerIdx]['lastT'] = timestamp
             
     def getMessages(self, cursor, timeClause):
-        previousSpeaker = None
-        previousTimestamp = 0
-        previousType = -1
+        self.records = list(self.iterMessages(cursor, timeClause))
 
-        T = 10*60;
-        
+    # the speaker graph of iterMessages alone, without processing the messages
+    def getSpeakerGraph(self, cursor, timeClause):
+        self._initSpeakerGraph()
+        where, params = timeClause
+        self._execute(cursor, self.SQL_Templates['get_messages'] % (self.Chat_Table, where), params)
+        Items = self.Items
+        cnt = 0
+        for row in self._fetchRows(cursor):
+            speaker, idx = self._parseSpeaker(row[Items['Message']], row[Items['Type']])
+            self._updateSpeakerGraph(speaker, self.calendar.biased(row[Items['CreateTime']]))
+            cnt += 1
+        self.profiler.count('sql.rows', cnt)
+
+    # the message records in time order, each one yielded once no later message binds to it
+    def iterMessages(self, cursor, timeClause):
+        for record in bindRecords(self._iterRendered(cursor, timeClause)):
+            yield record
+
+    # (timestamp, speaker, msgtype, rendered message, msgid) in time order, the speaker graph updated along
+    def _iterRendered(self, cursor, timeClause):
         cur = cursor;
-        record = []
         self._initSpeakerGraph()
         
-        cur.execute( self.SQL_Templates['get_messages'] % (self.Chat_Table, timeClause))
+        where, params = timeClause
+        self._execute(cur, self.SQL_Templates['get_messages'] % (self.Chat_Table, where), params)
         # marshall chat message record
         cnt = 0;
-        for row in cur:
+        for row in self._fetchRows(cur):
             msg = row[self.Items['Message']]         
             msgtype = row[self.Items['Type']]   
             #parsing name
             speaker,idx = self._parseSpeaker(msg, msgtype)
             #get message info
             msgid = row[self.Items['MsgLocalID']]
-            timestamp = (int(row[self.Items['CreateTime']])+self.time_bias)
+            timestamp = self.calendar.biased(row[self.Items['CreateTime']])
             #clean up message
             msg = msg[idx+1:].strip()
             msg = self.processMessage( msg, msgtype, msgid )
-            timestep = timestamp-previousTimestamp;            
             self._updateSpeakerGraph(speaker, timestamp)
-            # check if adjacent messages can be binded
-            if (speaker == previousSpeaker and 
-                timestep < T and 
-                msgtype == previousType):
-                record[-1][3] += "; "+msg
-            else:
-                if len(record)>0:
-                    previousMsg = record[-1][3]
-                else:
-                    previousMsg = '' 
-                previousSpeaker = speaker
-                previousType = msgtype
-                record.append([timestamp, speaker, msgtype, msg])
-            previousTimestamp = timestamp
-        self.records = record
-
-    def _parseSpeaker(self, msg, msgtype):
+            yield timestamp, speaker, msgtype, msg, msgid
+            cnt += 1
+        self.profiler.count('sql.rows', cnt)
+
+    def _parseSpeaker(self, msg, msgtype, speakers=None):
         parser = ':\n'
         idx = msg.find(parser) 
         if idx < 0 :
             if msgtype == 48 or msgtype == 43:
-                root = etree.fromstring( msg );
-                node = root[0];
-                d = node.attrib;
-                speaker = d['fromusername']                
+                speaker = self._decodePayload('speaker', msg)
             elif msgtype > 1000:
                 speaker = "system"
             else:
                 speaker = self.dataProvider
         else:
-            speaker = self.speakers[msg[0:idx]]
+            speakers = self.speakers if speakers is None else speakers
+            speaker = speakers[msg[0:idx]]
         return speaker, idx
     
     def processMessage(self, msg, msgtype, msgid):
+        if not self.renderCache or msgtype not in self.renderCacheTypes:
+            return self._renderMessage(msg, msgtype, msgid)
+        cache = self._openRenderCache()
+        digest = hashlib.md5(msg.encode('utf-8')).digest()
+        fingerprint = ''
+        if msgtype == 49:
+            # the file links depend on the attachments found for the message
+            fingerprint = '|'.join(self._attachmentFiles(self.MsgType_Folder['49'], msgid))
+        html = cache.get(msgid, digest, fingerprint)
+        if html is None:
+            self.profiler.count('render.rendered')
+            html = self._renderMessage(msg, msgtype, msgid)
+            cache.put(msgid, digest, fingerprint, html)
+        else:
+            self.profiler.count('render.cached')
+        return html
+
+    """
+    rendered message cache: only the types decoding an xml payload are kept, the others render
+    faster than a lookup
+    """
+    renderCacheFile = 'render.sqlite'
+    renderCacheTypes = (47, 49)
+    renderCacheSize = 500000
+
+    def _openRenderCache(self):
+        if self.rendered is None:
+            if not os.path.isdir(self.htmlFolder):
+                os.makedirs(self.htmlFolder)
+            settings = [self.MsgType_Folder]+self._templateSettings()
+            self.rendered = RenderCache(self.htmlFolder+self.renderCacheFile, self.Chat_Table,
+                                        hashlib.md5(json.dumps(settings)).hexdigest(), self.renderCacheSize)
+        return self.rendered
+
+    # write the messages rendered since the cache was opened
+    def _closeRenderCache(self):
+        if self.rendered is not None:
+            self.rendered.close()
+            self.rendered = None
+
+    def _renderMessage(self, msg, msgtype, msgid):
         fDict = self.MsgType_Folder    
         folder = '' if not fDict.has_key(str(msgtype)) else fDict[str(msgtype)]
         if msgtype == 49:
@@ -466,53 +885,111 @@ class Chat2HTML_EXPORTER:
             msg = self._process_others(msg)
         return msg
 
-    def _process_emoji(self, msg, folder):
-        #look for <msg><emoji md5="$1" /></msg>
+    """
+    payload decoding: the few fields read from an xml payload are cached by the payload hash,
+    as the same stickers and shared articles appear thousands of times
+    """
+    payloadCacheSize = 10000
+
+    def _decodePayload(self, kind, msg):
+        cache = self.payloadCache
+        key = (kind, hashlib.md5(msg.encode('utf-8')).digest())
+        value = cache.pop(key, cache)
+        if value is cache:
+            self.profiler.count('payload.decoded')
+            value = getattr(self, '_decode_'+kind)(msg)
+            if len(cache) >= self.payloadCacheSize:
+                cache.popitem(last=False)
+        else:
+            self.profiler.count('payload.cached')
+        cache[key] = value
+        return value
+
+    def _decode_speaker(self, msg):
+        simple = parseSimplePayload(msg)
+        if simple is not None:
+            return simple[1]['fromusername']
+        self.profiler.count('xml.parsed')
+        root = etree.fromstring( msg );
+        node = root[0];
+        d = node.attrib;
+        return d['fromusername']
+
+    def _decode_emoji(self, msg):
+        simple = parseSimplePayload(msg)
+        if simple is not None:
+            tag, d = simple
+            return d["md5"] if tag == 'emoji' else None
+        self.profiler.count('xml.parsed')
         root = ET.fromstring( msg );
         node = root.find('emoji');
+        return None if node is None else node.attrib["md5"]
+
+    def _decode_location(self, msg):
+        simple = parseSimplePayload(msg)
+        if simple is not None:
+            tag, d = simple
+            if tag != 'location':
+                return None
+        else:
+            self.profiler.count('xml.parsed')
+            root = etree.fromstring( msg );
+            node = root.find('location');
+            if node is None:
+                return None
+            d = node.attrib;
+        return d['x'], d['y'], d['scale'], d['label']
+
+    def _decode_appmsg(self, msg):
+        self.profiler.count('xml.parsed')
+        root = etree.fromstring(msg)
+        node = root.find('appmsg');
         if node is None:
+            return None
+        nodeType = node.find('type').text;
+        title = node.find('title').text;
+        if nodeType == '6':
+            return nodeType, title, None, None
+        return nodeType, title, node.find('des').text, node.find('url').text
+
+    def _process_emoji(self, msg, folder):
+        #look for <msg><emoji md5="$1" /></msg>
+        code = self._decodePayload('emoji', msg)
+        if code is None:
             return self.unknownMsgTemplate % 'an unknown emotion'
-        code = node.attrib["md5"];
         # then generate <img src="emoticon1/$1.jpg" />        
         return self.emojiMsgTemplate % (folder, code)
 
     def _process_location(self, msg):        
         #look for <msg><location x="$1" y="$2" scale="$3" label="$4" /></msg>
-        root = etree.fromstring( msg );
-        node = root.find('location');
-        if node is None:
+        location = self._decodePayload('location', msg)
+        if location is None:
             return self.unknownMsgTemplate % 'an unknown location'
 
         # the hyperlink to produce <a href="https://www.google.com/maps/@$1,$2,$3z">$4</a>
-        d = node.attrib;
-        url = self.locationURLTemplate % (d['x'], d['y'], d['scale'])
-        msg = self.linkMsgTemplate % (url, d['label'])
+        x, y, scale, label = location
+        url = self.locationURLTemplate % (x, y, scale)
+        msg = self.linkMsgTemplate % (url, label)
         return msg
 
     def _process_appmsg(self, msg, msgid, folder):
         #look for <msg><appmsg><type>$1</type><appmsg><msg> first
-        root = etree.fromstring(msg)
-        node = root.find('appmsg');
-        if node is None:
+        appmsg = self._decodePayload('appmsg', msg)
+        if appmsg is None:
             return '<span class="unknown">an unknown link</span'
-        nodeType = node.find('type');
-        title = node.find('title');
+        nodeType, title, des, url = appmsg
         # it is a OpenData file link, parse the <title>$2</title> content for the original filename
-        if nodeType.text == '6':
-            wildcard = '%s%s/%s.*' % (self.htmlFolder, folder, msgid)
-            file = glob.glob( wildcard )
+        if nodeType == '6':
+            file = self._attachmentFiles(folder, msgid)
             if len(file) < 1:
-                return self.unknownMsgTemplate % title.text
+                return self.unknownMsgTemplate % title
             #   and generate the hyperlink <a href="OpenData/$msgid.ext">original filename</a>
-            name = file[0];
-            name = name.replace(self.htmlFolder, '')
-            return self.linkMsgTemplate % (name, title.text)
+            name = '%s/%s' % (folder, file[0])
+            return self.linkMsgTemplate % (name, title)
         else:
             # otherwise look for <msg><appmsg ><title>$2</title><des>$3</des><url>$4</url></appmsg></msg>
-            des = node.find('des')
-            url = node.find('url')
             #   and generate the hyperllink <a href="$4"><div class="title">$2</div><div class="des">$3</div></a>
-            return self.link2MsgTemplate % (url.text, title.text, des.text)
+            return self.link2MsgTemplate % (url, title, des)
 
     def _process_audio(self, msgid, folder):        
         return self.audioMsgTemplate % (folder, msgid)
@@ -523,17 +1000,149 @@ class Chat2HTML_EXPORTER:
     def _process_img(self, msgid, folder):
         filename = '%s/%s' % (folder, msgid)
         msg = self.imgTagTemplate % filename       
-        file = glob.glob( 'html/%s.*' % filename )
+        file = self._attachmentFiles(folder, msgid)
         if len(file) > 1:
             msg = self.imgMsgTemplate % (filename, msg)
         return msg
 
+    # the attachment folders below htmlFolder, indexed once instead of globbing per message
+    AttachmentFolders = ('Img', 'OpenData', 'Video', 'Audio', 'emoticon1')
+
+    def _loadAttachments(self, cache=None):
+        """
+        list every attachment folder once into {folder: {'mtime': .., 'files': {msgid: [file names]}}},
+        with an attachment cache a folder is only listed again when its modification time changed
+        :param cache: the listings by folder path shared by the exporters of all conversations,
+                      the caller reads and writes the attachment cache file then
+        """
+        if self.attachments is not None:
+            return None
+        shared = cache is not None
+        if not shared:
+            cache = self._readAttachmentCache()
+
+        index = {}
+        for folder in self.AttachmentFolders:
+            path = self.htmlFolder+folder
+            mtime = os.path.getmtime(path) if os.path.isdir(path) else None
+            entry = cache.get(path)
+            if entry is None or entry['mtime'] != mtime:
+                files = {}
+                if mtime is not None:
+                    self.profiler.count('attachments.listed')
+                    for name in os.listdir(path):
+                        # the same files as the former glob of folder/msgid.*
+                        idx = name.find('.')
+                        if idx > 0:
+                            files.setdefault(name[0:idx], []).append(name)
+                entry = {'mtime': mtime, 'files': files}
+            index[folder] = cache[path] = entry
+        self.attachments = index
+
+        if not shared:
+            self._writeAttachmentCache(cache)
+        return None
+
+    def _readAttachmentCache(self):
+        cacheFile = self.attachmentCache
+        if cacheFile is None or not os.path.exists(cacheFile):
+            return {}
+        fid = codecs.open(cacheFile, "r", encoding="utf-8")
+        cache = json.load(fid)
+        fid.close()
+        return cache
+
+    def _writeAttachmentCache(self, cache):
+        cacheFile = self.attachmentCache
+        if cacheFile is None:
+            return None
+        fid = codecs.open(cacheFile, "w", encoding="utf-8")
+        fid.write(json.dumps(cache))
+        fid.close()
+
+    """
+    materialization of the attachments: the files of the backup below dbFolder, Img/<chat id>/*.pic,
+    Video/<chat id>/*.mp4, OpenData/<chat id>/* and emoticon1/*, are linked into the attachment
+    folders under the names the pages use, see chat_media.py
+    """
+    # the backup folders of the message types carrying attachments, besides the emoticons
+    MediaTypes = {3: 'Img', 43: 'Video', 49: 'OpenData'}
+
+    def materializeAttachments(self, startTime, stopTime, mode='link', jobs=4):
+        """
+        link the attachments of the messages from startTime to stopTime into htmlFolder,
+        the files already in place are left alone, so a re-run only adds the new ones
+        :param mode: 'link' for hard links, or reflinks and copies across file systems,
+                     'symlink' for symbolic links to the backup
+        :param jobs: number of threads creating the links
+        """
+        self._openDB()
+        counts = self._materializeAttachments(self.cur, str2epoch(startTime), str2epoch(stopTime), mode, jobs)
+        self._closeDB()
+        return counts
+
+    def _materializeAttachments(self, cursor, a, b, mode, jobs):
+        where, params = self._get_timeFrame_from_timestamp(a, b)
+        self._execute(cursor, self.SQL_Templates['get_media_messages'] % (self.Chat_Table, where), params)
+        referenced = dict([(folder, set()) for folder in self.MediaTypes.itervalues()])
+        emojis = set()
+        for msgid, msgtype, msg in cursor.fetchall():
+            if msgtype == 47:
+                idx = msg.find(':\n')
+                code = self._decodePayload('emoji', msg[idx+1:].strip())
+                if code is not None:
+                    emojis.add(code)
+            else:
+                referenced[self.MediaTypes[msgtype]].add(str(msgid))
+
+        chatID = self.Chat_Table[len('Chat_'):]
+        sources = [(os.path.join(self.dbFolder, folder, chatID), folder, ids)
+                   for folder, ids in referenced.iteritems()]
+        sources.append((os.path.join(self.dbFolder, 'emoticon1'), 'emoticon1', emojis))
+        pairs = []
+        for source, folder, ids in sources:
+            if not ids or not os.path.isdir(source):
+                continue
+            for name in os.listdir(source):
+                if name.split('.')[0] in ids:
+                    pairs.append((os.path.join(source, name),
+                                  os.path.join(self.htmlFolder, folder, chat_media.targetName(name))))
+        counts = chat_media.materializeFiles(pairs, mode, jobs)
+        # the attachment folders are listed again
+        self.attachments = None
+        print "...attachments of %s: %s" % (self.Chat_Table, ", ".join(
+            ["%d %s" % (n, result) for result, n in sorted(counts.iteritems()) if n]) or "none")
+        return counts
+
+    def _attachmentFiles(self, folder, msgid):
+        self.profiler.count('attachments.lookups')
+        self._loadAttachments()
+        return self.attachments[folder]['files'].get(str(msgid), [])
+
     def _process_text(self, msg):        
         return msg.replace('\n', '<br />')
 
     def _process_others(self, msg):
         return msg
 
+    writeBufferSize = 1 << 16
+    # row batches read ahead and pages waiting to be written in a pipelined export
+    readAheadBatches = 8
+    writeBehindPages = 4
+
+    # a file for the page, handed to the writer thread in a pipelined export
+    def _openPage(self, filename):
+        if self.writer is not None:
+            return self.writer.open(filename)
+        return codecs.open(filename, "w", encoding="utf-8", buffering=self.writeBufferSize)
+
+    def _pageWritten(self, filename):
+        # the writer counts the bytes of the pipelined pages
+        if self.profiler.enabled and self.writer is None:
+            self.profiler.count('bytes.written', os.path.getsize(filename))
+        self.exported.append((filename, self.messageTotal))
+        print '...exported %s' % filename
+
     TXTparser = '-------------------------------------------'
     def exportStatTXT(self):
         parset = self.TXTparser
@@ -556,7 +1165,7 @@ class Chat2HTML_EXPORTER:
     def exportRecordTXT(self):
         msg = [];
         for item in self.records:
-            msg.append("%s: %s" % (item[1], item[3]));
+            msg.append("%s: %s" % (item.speaker, item.msg));
         return "\n".join(msg)
     
     def exportStatHTML(self):
@@ -583,40 +1192,178 @@ class Chat2HTML_EXPORTER:
         stat = self.statTemplate %(self.statType, queryName, nt, typeStat, ns, speakerStat)
         return stat
 
-    def exportRecordHTML(self):
+    def _iterRecordHTML(self):
         mt = self.messageTemplate
-        records = []
+        timeString = self.calendar.timeString
         for item in self.records:
-            timestamp = item[0]
-            timestr = datetime.datetime.fromtimestamp(timestamp)
-            records.append( mt % (item[0], item[1], item[2], timestr, item[1], item[3]) )
-        records = "\n".join(records)
-        return records
+            timestamp = item.timestamp
+            timestr = timeString(timestamp)
+            yield mt % (timestamp, item.msgid, item.speaker, item.msgtype, timestr, item.speaker, item.msg)
+
+    def exportRecordHTML(self):
+        return "\n".join(self._iterRecordHTML())
 
     def exportArchiveHTML(self):
         stat = self.exportStatHTML()
         records = self.exportRecordHTML()
         archive = self.archiveLeafTemplate % (self.queryName, stat, records)
         return archive
-    
+
+    # the pieces of a template split at its trailing fields, the leading fields formatted with args
+    TemplateField = '\0field\0'
+    def _splitFields(self, template, args, nFields):
+        return (template % (args + (self.TemplateField,)*nFields)).split(self.TemplateField)
+
     def exportHTML(self):
+        """
+        the page is written piece by piece to a buffered file: the head, the speaker graphs,
+        the statistics, every record and the footer, the whole page never exists as one string
+        """
         if self.messageTotal < 1:
             return None
-        archive = self.exportArchiveHTML()
         startTime = self.startTime
         stopTime = self.stopTime
         currentTime = time.strftime("%c")
-        
-        contents = self.htmlTemplate % (currentTime, json.dumps(self.speakerGraphs), archive)
+        head, body, tail = self._splitFields(self.htmlTemplate, (currentTime,), 2)
+        leafHead, leafTail = self._splitFields(self.archiveLeafTemplate,
+                                               (self.queryName, self.exportStatHTML()), 1)
 
-        filename = '%s%s.html'%(self.htmlFolder,self.queryName)
-        
-        fid = codecs.open(filename, "w", encoding="utf-8")
-        fid.write(contents)
+        filename = self._pagePath(self.queryName)
+
+        fid = self._openPage(filename)
+        fid.write(head)
+        json.dump(self.speakerGraphs, fid)
+        fid.write(body)
+        fid.write(leafHead)
+        separator = ''
+        for record in self._iterRecordHTML():
+            fid.write(separator)
+            fid.write(record)
+            separator = "\n"
+        fid.write(leafTail)
+        fid.write(tail)
         fid.close()
-        print '...exported %s' % filename
+        self._pageWritten(filename)
         #webbrowser.open("file:///" + os.path.abspath(filename)) #elaborated for Mac
 
+    """
+    sharded archive: one json shard per day holding the statistics, the speaker graphs and the
+    rendered records, a shard index listing the days, and a single viewer page index.html
+    where gssb.js loads the shard of the day picked in the datepicker
+    """
+    shardFolder = 'json/'
+    shardIndexFile = 'shards.json'
+    shardViewerFile = 'index.html'
+
+    # the file of the exported page of a period, a json shard or an html page
+    def _pagePath(self, queryName):
+        if self.sharded:
+            return '%s%s%s.json' % (self.htmlFolder, self.shardFolder, queryName)
+        return '%s%s.html' % (self.htmlFolder, queryName)
+
+    def exportPage(self):
+        self.profiler.period()
+        if self.messageTotal < 1:
+            return self._removePage()
+        if self.search is not None:
+            self.search.addRecords(self.queryName, self.records)
+        if self.sharded:
+            return self.exportShard()
+        return self.exportHTML()
+
+    # a day without messages has no page, the page of a day emptied since the former export goes
+    def _removePage(self):
+        if self.search is not None:
+            self.search.clearDay(self.queryName)
+        filename = self._pagePath(self.queryName)
+        if os.path.exists(filename):
+            os.remove(filename)
+            print '...removed %s' % filename
+        return None
+
+    def exportShard(self):
+        if self.messageTotal < 1:
+            return None
+        shard = self._ensembleStat()
+        # the daily graph is in speakerGraphs already
+        del shard['speakerGraph']
+        shard['speakerGraphs'] = self.speakerGraphs
+        timeString = self.calendar.timeString
+        shard['record'] = [item.toList()+[timeString(item.timestamp), item.msgid] for item in self.records]
+
+        filename = self._pagePath(self.queryName)
+        folder = os.path.dirname(filename)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        fid = self._openPage(filename)
+        json.dump(shard, fid, separators=(',', ':'))
+        fid.close()
+        self._pageWritten(filename)
+
+    # update the shard index with the exported shards and write the viewer page
+    def saveShardIndex(self):
+        filename = self.htmlFolder+self.shardFolder+self.shardIndexFile
+        days = {}
+        if os.path.exists(filename):
+            fid = codecs.open(filename, "r", encoding="utf-8")
+            days = json.load(fid)['days']
+            fid.close()
+        for page, messageTotal in self.exported:
+            days[os.path.basename(page)[:-len('.json')]] = messageTotal
+        # drop the days whose shard is gone
+        for day in days.keys():
+            if not os.path.exists(self._pagePath(day)):
+                del days[day]
+        index = {'folder': self.shardFolder, 'msgTypes': self.MsgType_dict, 'days': days}
+        fid = codecs.open(filename, "w", encoding="utf-8")
+        fid.write(json.dumps(index, sort_keys=True))
+        fid.close()
+
+        currentTime = time.strftime("%c")
+        body = self.shardViewerTemplate % (self.shardFolder+self.shardIndexFile)
+        fid = codecs.open(self.htmlFolder+self.shardViewerFile, "w", encoding="utf-8")
+        fid.write(self.htmlTemplate % (currentTime, 'null', body))
+        fid.close()
+        print '...%d days in %s' % (len(days), filename)
+
+    """
+    full text search: the postings sharded by token for gssbSearch.js on search.html,
+    or the FTS5 sidecar database, see chat_search.py
+    """
+    searchFolder = 'search/'
+    searchPageFile = 'search.html'
+    searchDBFile = 'search.sqlite'
+    searchShards = 64
+
+    searchPageTemplate = '''<div id="search">
+    <input type="text" id="searchQuery" placeholder="search the texts and links" />
+    <div class="searchResults"></div></div>
+    <script src="{assets}js/gssbSearch.js"></script>
+    <script>
+    searchConfig = %s;
+    </script>
+    '''
+
+    def saveSearchIndex(self):
+        if self.searchIndex == 'fts5':
+            n = self.search.saveSidecar(self.htmlFolder+self.searchDBFile)
+            print '...%d records indexed in %s' % (n, self.htmlFolder+self.searchDBFile)
+            return None
+        n = self.search.saveShards(self.htmlFolder+self.searchFolder, self.searchShards)
+        if self.sharded:
+            page = {'page': self.shardViewerFile+'#{day}/{id}',
+                    'records': self.shardFolder+'{day}.json'}
+        else:
+            page = {'page': '{day}.html#{id}', 'records': '{day}.html'}
+        page.update({'meta': self.searchFolder+'meta.json', 'folder': self.searchFolder,
+                     'sharded': self.sharded})
+        currentTime = time.strftime("%c")
+        body = self.searchPageTemplate % json.dumps(page)
+        fid = codecs.open(self.htmlFolder+self.searchPageFile, "w", encoding="utf-8")
+        fid.write(self.htmlTemplate % (currentTime, 'null', body))
+        fid.close()
+        print '...%d tokens indexed in %s' % (n, self.htmlFolder+self.searchFolder)
+
     def _ensembleStat(self):
         data = {'startTime': self.startTime, 'stopTime': self.stopTime, 
                 'queryName': self.queryName,
@@ -624,15 +1371,22 @@ class Chat2HTML_EXPORTER:
                 'messageTotal': self.messageTotal,
                 'speakerTotal': len(self.speakers),
                 'speakerStat': self.speakerStat,
-                'speakerGraph': self.speakerGraph};
+                'speakerGraph': self._speakerGraphJSON()};
         return data
 
+    # the speaker graph with its link matrix as lists
+    def _speakerGraphJSON(self):
+        graph = dict(self.speakerGraph)
+        graph['links'] = graph['links'].tolist()
+        graph.pop('recent', None)
+        return graph
+
     def exportArchiveJSON(self, filename):
         import json
         if len(self.records)<1:
             return False
         archive = self._ensembleStat()
-        archive['record'] = self.records
+        archive['record'] = [item.toList() for item in self.records]
         fid = codecs.open(filename, "w", encoding="utf-8")
         fid.write(json.dumps(archive));
         fid.close();
@@ -648,17 +1402,123 @@ class Chat2HTML_EXPORTER:
         fid.close();
         return True
     
-    def _openDB(self):
+    # a text file for the json lines, gzip compressed when asked for or named *.gz
+    def _openJSONL(self, filename, compress=None):
+        if compress is None:
+            compress = filename.endswith('.gz')
+        folder = os.path.dirname(filename)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        if compress:
+            return gzip.open(filename, 'wb')
+        return open(filename, 'wb')
+
+    def saveArchiveJSONL(self, startTime, stopTime, filename, queryName=None, compress=None):
+        """
+        stream the messages from startTime to stopTime into a json lines file, with constant memory:
+        one {"record": [timestamp, speaker, msgtype, msg]} line per message as it is read, then one
+        {"stat": {...}} line with the statistics of the range and one {"speakerGraph": {...}} line,
+        all from a single scan of the range
+        :param compress: gzip the lines while writing, by default when filename ends with .gz
+        :return: number of record lines
+        """
+        self.startTime = startTime
+        self.stopTime = stopTime
+        self.queryName = queryName or '%s to %s' % (startTime, stopTime)
+        a, b = startTime, stopTime
+        if type(startTime) is str:
+            a, b = str2epoch(a), str2epoch(b)
+        self._openDB()
+        # the statistics and the graph are collected along, the records are bound as in iterMessages
+        acc = PeriodAccumulator(self, a, b)
+        nicknames = {}
+        fid = self._openJSONL(filename, compress)
+        n = 0
+        for item in bindRecords(self._renderScanned(self._scanMessages(self.cur, a, b, nicknames), acc)):
+            fid.write(json.dumps({'record': item.toList()})+'\n')
+            n += 1
+        acc.close(nicknames, self.MsgType_dict)
+        self._loadPeriod(acc)
+        stat = self._ensembleStat()
+        graph = stat.pop('speakerGraph')
+        fid.write(json.dumps({'stat': stat})+'\n')
+        fid.write(json.dumps({'speakerGraph': graph})+'\n')
+        fid.close()
+        self._closeDB()
+        self.profiler.count('bytes.written', os.path.getsize(filename))
+        print '...exported %d records to %s' % (n, filename)
+        return n
+
+    # the scanned messages rendered for bindRecords, counted into the accumulator acc along
+    def _renderScanned(self, messages, acc):
+        for usr, speaker, timestamp, msgtype, msgid, msg in messages:
+            acc.add(usr, speaker, timestamp, msgtype, None)
+            yield timestamp, speaker, msgtype, self.processMessage( msg, msgtype, msgid ), msgid
+
+    def _openDB(self, readOnly=False, allTables=False):
         # connect db
-        self.conn = sqlite3.connect(self.dbFolder+'/'+self.dbFile);
+        dbFile = self.dbFolder+'/'+self.dbFile
+        if self.indexedDB is not None:
+            # the working copy is prepared by the parent before any read-only worker starts
+            dbFile = self.indexedDB if readOnly else self._prepareIndexedDB(dbFile, allTables)
+        # the write-ahead log of a backup taken from a running app is only read without immutable
+        immutable = not os.path.exists(dbFile+'-wal')
+        self.conn = connectReadOnly(dbFile, immutable, self.mmapSize, self.cacheSize, self.pipeline)
         self.cur = self.conn.cursor();
 
+    # copy the original db when the working copy is missing or outdated, and index the chat table,
+    # or every chat table for the export of all conversations
+    def _prepareIndexedDB(self, dbFile, allTables=False):
+        copyFile = self.indexedDB
+        if (not os.path.exists(copyFile) or
+            os.path.getmtime(copyFile) < os.path.getmtime(dbFile)):
+            print '...copying %s to %s' % (dbFile, copyFile)
+            shutil.copyfile(dbFile, copyFile)
+        conn = sqlite3.connect(copyFile)
+        tables = [self.Chat_Table]
+        if allTables:
+            tables = [row[0] for row in conn.execute(self.SQL_Templates['list_chat_tables'])]
+        for table in tables:
+            # the (CreateTime, Type) index of earlier copies reordered the messages sent in the same second
+            conn.execute(self.SQL_Templates['drop_type_index'] % table)
+            conn.execute(self.SQL_Templates['create_time_index'] % (table, table))
+        conn.commit()
+        conn.close()
+        return copyFile
+
+    # every query goes through here, the statements are parameterized so sqlite can reuse them
+    def _execute(self, cursor, sql, params=()):
+        if self.explainQueries and sql not in self.explainedQueries:
+            self.explainedQueries.add(sql)
+            plan = cursor.execute(self.SQL_Templates['explain'] % sql, params).fetchall()
+            print '...query plan of: %s' % sql
+            for row in plan:
+                print '      %s' % row[-1]
+        self.profiler.count('sql.statements')
+        return cursor.execute(sql, params)
+
+    # the rows of the last statement, fetched fetchSize at a time
+    def _fetchRows(self, cursor):
+        size = self.fetchSize
+        rows = cursor.fetchmany(size)
+        while rows:
+            for row in rows:
+                yield row
+            rows = cursor.fetchmany(size)
+
     def _closeDB(self):
         # close db
         self.conn.close()
+        self.statBuckets = None
+        if self.cube is not None:
+            self.cube.close()
+            self.cube = None
+        self._closeRenderCache()
 
+    # the time limitation clause along with its bound parameters
     def _get_timeFrame_from_timestamp(self, a, b ):
-        return self.SQL_Templates['get_messages_where'] % (a-self.time_bias, b-self.time_bias)
+        calendar = self.calendar
+        return self.SQL_Templates['get_messages_where'], (calendar.unbiased(a), calendar.unbiased(b))
     
     def _get_timeFrame(self, startTime, stopTime):
         a = startTime
@@ -679,42 +1539,196 @@ class Chat2HTML_EXPORTER:
         self._queryData(timeFrame, self.cur)
         self._closeDB();
 
-    def _queryData(self, timeFrame, cur):
+    def _queryData(self, timeFrame, cur, period=None):
         # collect statistic
-        self.getMessageStat(cur, timeFrame)
+        self.getMessageStat(cur, timeFrame, period)
         self.getSpeakerInfo(cur, timeFrame)
         # collect and process messages
         self.getMessages(cur, timeFrame)
 
-    def _queryMonthly(self, timestamp):
-        t = time.localtime(float(timestamp));
-        nt = nextMonth(timestamp)
-        self.startTime = epoch2str(timestamp);
-        self.stopTime = epoch2str(nt)
+    # the statistics and the speaker graph of a period, without the messages
+    def _queryStat(self, timeFrame, cur, period=None):
+        if self.cube is not None and period is not None:
+            self._queryCubeStat(*period)
+            return None
+        self.getMessageStat(cur, timeFrame, period)
+        self.getSpeakerInfo(cur, timeFrame)
+        self.getSpeakerGraph(cur, timeFrame)
+
+    # the statistics and the speaker graph of the days [a, b) summed from the cube
+    def _queryCubeStat(self, a, b):
+        first, stop = self.calendar.day(a), self.calendar.day(b)
+        cube = self.cube
+        self._setMessageStat(cube.typeCount(self.Chat_Table, first, stop))
+        self._setSpeakerStat(self.cur, cube.speakerCount(self.Chat_Table, first, stop))
+        self._initSpeakerGraph()
+        graph = self.speakerGraph
+        d = graph['nameDict']
+        lastT = cube.lastTimes(self.Chat_Table, first, stop)
+        for node in graph['nodes']:
+            node['lastT'] = lastT.get(node['name'], node['lastT'])
+        links = graph['links']
+        for (speaker, other), count in cube.graph(self.Chat_Table, first, stop).iteritems():
+            if d.has_key(speaker) and d.has_key(other):
+                links.add(d[speaker], d[other], count)
+
+    def _openStatCube(self, cursor):
+        """
+        open the cube of statCube and count the messages added since its last update, the days
+        from the first one whose counted messages were edited or removed are counted again, the
+        cube of the chat table is rebuilt when the settings changed; the graph links only reach
+        back to the day before, minute_thresh is less than a day
+        """
+        if self.statCube is None or self.cube is not None:
+            return None
+        self.cube = cube = StatCube(self.statCube)
+        table = self.Chat_Table
+        self._loadFriends(cursor)
+        # the day buckets are cut in local time, the graph links and last times are kept by nickname
+        friends = hashlib.md5(json.dumps(sorted(self.nicknames.iteritems()))).hexdigest()
+        settings = json.dumps([self.time_bias, self.dataProvider, self.minute_thresh, zoneSignature(), friends])
+        state = cube.state(table)
+        window = cube.window(table)
+        maxId = 0
+        if state is not None and state[2] == settings and window is not None:
+            maxId = state[0]
+        else:
+            cube.reset(table)
+            window = {}
+        counted, signatures = self._daySignaturesUpto(cursor, maxId)
+        stored = cube.signatures(table)
+        changed = [day for day in set(counted) | set(stored) if counted.get(day) != stored.get(day)]
+        recent = RecentSpeakers(self.minute_thresh * 60)
+        # the counted messages before since only bring back the speakers active at its start
+        since = None
+        if maxId > 0 and changed:
+            firstDay = min(changed)
+            print '...the stat cube counts the days from %s again' % firstDay
+            cube.rewind(table, firstDay)
+            since = str2epoch(firstDay)
+            self._execute(cursor, self.SQL_Templates['get_messages_since'] % table,
+                          (self.calendar.unbiased(since-recent.T), maxId))
+        else:
+            recent.resume(window)
+            self._execute(cursor, self.SQL_Templates['get_messages_after'] % table, (maxId,))
+        lastId = maxId
+        Items = self.Items
+        calendar = self.calendar
+        unlabeledSpeaker = self.dataProvider
+        nicknames = {}
+        counts = {}
+        links = {}
+        lastT = {}
+        added = 0
+        for row in self._fetchRows(cursor):
+            msg = row[Items['Message']]
+            msgtype = row[Items['Type']]
+            timestamp = calendar.biased(row[Items['CreateTime']])
+            replay = since is not None and timestamp < since and row[Items['MsgLocalID']] <= lastId
+            day = calendar.day(timestamp)
+            idx = msg.find(':\n')
+            # the speaker ids of getSpeakerInfo
+            usr = unlabeledSpeaker if idx < 0 else msg[0:idx]
+            if not replay:
+                key = (day, msgtype, usr)
+                counts[key] = counts.get(key, 0)+1
+            # the speaker names of the graph, as in _scanMessages
+            if not nicknames.has_key(usr):
+                nicknames[usr] = self._lookupNickname(usr)
+            speaker, idx = self._parseSpeaker(msg, msgtype, nicknames)
+            if replay:
+                recent.update(speaker, timestamp)
+                continue
+            for name in recent.update(speaker, timestamp):
+                link = links.setdefault((day, speaker, name), [0, 0])
+                link[0 if calendar.day(recent.lastT[name]) == day else 1] += 1
+            lastT[(day, speaker)] = timestamp
+            maxId = max(maxId, row[Items['MsgLocalID']])
+            added += 1
+        self.profiler.count('sql.rows', added)
+        rows = sum([json.loads(signature)[0] for signature in signatures.itervalues()])
+        cube.add(table, counts, links, lastT, recent.active(), maxId, rows, settings, signatures)
+        if added:
+            print '...%d messages added to the stat cube %s' % (added, self.statCube)
+
+    # the content signatures {day: json} of the messages up to maxId and of all messages, summed
+    # per quarter of an hour in sqlite, the days are those of the calendar
+    def _daySignaturesUpto(self, cursor, maxId):
+        self._execute(cursor, self.SQL_Templates['count_quarter_content'] % self.Chat_Table,
+                      (self.time_bias, maxId))
+        counted = {}
+        signatures = {}
+        for row in self._fetchRows(cursor):
+            day = self.calendar.day(row[0]*900)
+            targets = [signatures, counted] if row[1] else [signatures]
+            for days in targets:
+                sig = days.setdefault(day, [0, 0, 0, 0])
+                for i in range(4):
+                    sig[i] += row[i+2]
+        counted = dict([(day, json.dumps(sig)) for day, sig in counted.iteritems()])
+        signatures = dict([(day, json.dumps(sig)) for day, sig in signatures.iteritems()])
+        return counted, signatures
+
+    def rangeStat(self, startTime, stopTime, queryName=None):
+        """
+        the statistics of exportStatJSON from startTime to stopTime, with the speaker graph in the
+        form drawn by SpeakerGraph of gssbSpeakerGraph.js, summed from the day buckets of statCube
+        when set, otherwise counted on the chat table
+        """
+        self.startTime = startTime
+        self.stopTime = stopTime
+        self.queryName = queryName or '%s to %s' % (startTime, stopTime)
+        timeFrame = self._get_timeFrame(startTime, stopTime)
+        self._openDB()
+        self._openStatCube(self.cur)
+        if self.cube is not None:
+            self._queryCubeStat(str2epoch(startTime), str2epoch(stopTime))
+        else:
+            self._queryStat(timeFrame, self.cur)
+        self._closeDB()
+        return {'startTime': self.startTime, 'stopTime': self.stopTime, 'queryName': self.queryName,
+                'messageStat': self.messageStat, 'messageTotal': self.messageTotal,
+                'speakerTotal': len(self.speakers), 'speakerStat': self.speakerStat,
+                'speakerGraph': self._ensembleSpeakerGraph()}
+
+    def _setMonthlyPeriod(self, timestamp):
+        calendar = self.calendar
+        t, nt = calendar.month(timestamp)
+        self.startTime = calendar.date(timestamp);
+        self.stopTime = calendar.date(nt)
         self.statType = "monthly"
         self.queryName = 'month%2d %s to %s' % (t[1], 
                                                 self.startTime, 
-                                                epoch2str(nt-1))
+                                                calendar.date(nt-1))
+        return t, nt
+
+    def _queryMonthly(self, timestamp, statOnly=False):
+        t, nt = self._setMonthlyPeriod(timestamp)
         # the time limitation clause for all queries
         timeFrame = self._get_timeFrame_from_timestamp(timestamp, nt)
-        self._queryData(timeFrame, self.cur)
+        query = self._queryStat if statOnly else self._queryData
+        query(timeFrame, self.cur, (timestamp, nt))
         self.speakerGraphs['monthly'] = self._ensembleSpeakerGraph()
         return t, nt
     
-    def _queryWeekly(self, timestamp):
-        nt = nextWeek(timestamp)
-        t = time.localtime(timestamp)
-        weekID = datetime.date(t[0], t[1], t[2]).isocalendar()[1]            
+    def _setWeeklyPeriod(self, timestamp):
+        calendar = self.calendar
+        t, nt, weekID = calendar.week(timestamp)
 
-        self.startTime = epoch2str(timestamp);
-        self.stopTime = epoch2str(nt);
+        self.startTime = calendar.date(timestamp);
+        self.stopTime = calendar.date(nt);
         self.statType = "weekly"
         self.queryName = 'week%2d %s to %s' % (weekID, 
                                                self.startTime, 
-                                               epoch2str(nt-1))
+                                               calendar.date(nt-1))
+        return t, nt, weekID
+
+    def _queryWeekly(self, timestamp, statOnly=False):
+        t, nt, weekID = self._setWeeklyPeriod(timestamp)
         # the time limitation clause for all queries
         timeFrame = self._get_timeFrame_from_timestamp(timestamp, nt)
-        self._queryData(timeFrame, self.cur);
+        query = self._queryStat if statOnly else self._queryData
+        query(timeFrame, self.cur, (timestamp, nt));
         self.speakerGraphs['weekly'] = self._ensembleSpeakerGraph()
         return t, nt, weekID
     
@@ -722,9 +1736,13 @@ class Chat2HTML_EXPORTER:
         print "from saveMonthlyStatJSON"
         timestamp = str2epoch(startTime)
         stopTimeStamp = str2epoch(stopTime)        
+        self.speakerGraphs = self._initQueryStatistics();
         self._openDB();
+        self._openStatCube(self.cur)
+        if self.cube is None:
+            self._prefetchStatBuckets(self.cur, timestamp, self.calendar.month(stopTimeStamp-1)[1])
         while timestamp < stopTimeStamp:
-            t, nt = self._queryMonthly(timestamp)
+            t, nt = self._queryMonthly(timestamp, statOnly=True)
             filename = '%sjson/%.4d_month%.2d.json' % (self.htmlFolder, t[0], t[1])
             if self.exportStatJSON(filename):
                 print "...%s, %d messages" % (self.queryName, self.messageTotal)
@@ -738,9 +1756,13 @@ class Chat2HTML_EXPORTER:
         timestamp = str2epoch(startTime)        
         stoTimeStamp = str2epoch(stopTime)        
         timestampStep = 7*DailyTimestampStep;
+        self.speakerGraphs = self._initQueryStatistics();
         self._openDB();
+        self._openStatCube(self.cur)
+        if self.cube is None:
+            self._prefetchStatBuckets(self.cur, timestamp, self.calendar.week(stoTimeStamp-1)[1])
         while timestamp < stoTimeStamp:
-            t, nt, weekID = self._queryWeekly(timestamp)
+            t, nt, weekID = self._queryWeekly(timestamp, statOnly=True)
             filename = '%sjson/%.4d_week%.2d.json' % (self.htmlFolder, t[0], weekID)
             if self.exportStatJSON(filename):
                 print "...%s, %d messages" % (self.queryName, self.messageTotal)
@@ -751,7 +1773,7 @@ class Chat2HTML_EXPORTER:
 
     def _ensembleSpeakerGraph(self):
         nd = self.speakerGraph['nodes'];
-        lk = self.speakerGraph['links'];
+        lk = self.speakerGraph['links'].tolist();
 
         nodes = []
         for item in nd:
@@ -773,54 +1795,543 @@ class Chat2HTML_EXPORTER:
         fid.write(json.dumps(self.speakerGraphs));
         fid.close();
 
-    def _queryDaily(self, timestamp):
+    def _setDailyPeriod(self, timestamp):
         nt = timestamp + DailyTimestampStep;
-        self.startTime = epoch2str(timestamp);
-        self.stopTime = epoch2str(nt);
+        self.startTime = self.calendar.date(timestamp);
+        self.stopTime = self.calendar.date(nt);
         self.queryName = self.startTime
         self.statType = 'daily'
+        return nt
+
+    def _queryDaily(self, timestamp):
+        nt = self._setDailyPeriod(timestamp)
         # the time limitation clause for all queries
         timeFrame = self._get_timeFrame_from_timestamp(timestamp, nt)
-        self._queryData(timeFrame, self.cur);
+        self._queryData(timeFrame, self.cur, (timestamp, nt));
         self.speakerGraphs['daily'] = self._ensembleSpeakerGraph()
         return nt
         
-    def saveDailyArchive(self, startTime, stopTime):
+    def saveDailyArchive(self, startTime, stopTime, singleScan=False, incremental=False, jobs=1):
+        """
+        :param singleScan: read the chat table once and derive the daily, weekly and monthly
+                           periods from the same pass instead of querying every period
+        :param incremental: only rebuild the daily pages whose day, or whose monthly/weekly period
+                            starting on that day, changed since the run recorded in the manifest
+        :param jobs: number of worker processes, each exporting its own chunk of days
+        """
         print "from saveDailyArchiveJSON"
         timestamp = str2epoch(startTime)
         stoTimeStamp = str2epoch(stopTime)
         self._openDB();
-        while timestamp < stoTimeStamp:
+        self._exportArchive(timestamp, stoTimeStamp, singleScan, incremental, jobs)
+        self._closeDB();
+        return None
+
+    # export the archive of the chat table on the open connection
+    def _exportArchive(self, timestamp, stoTimeStamp, singleScan, incremental, jobs):
+        self.calendar.precompute(timestamp, self.calendar.lastStop(stoTimeStamp))
+        rebuild = None
+        if incremental:
+            rebuild, manifest = self._planIncremental(self.cur, timestamp, stoTimeStamp)
+            print "...%d daily pages to rebuild" % len(rebuild)
+        if jobs > 1:
+            self._exportParallel(timestamp, stoTimeStamp, singleScan, rebuild, jobs)
+        else:
+            self._exportDays(timestamp, stoTimeStamp, singleScan, rebuild)
+        if incremental:
+            self._saveManifest(manifest)
+        if self.sharded:
+            self.saveShardIndex()
+        self._closeRenderCache()
+        if self.search is not None:
+            self.saveSearchIndex()
+        return None
+
+    """
+    export of all conversations: every Chat_<md5> table goes to its own folder htmlFolder/<md5>/,
+    the md5 being the one of the UsrName of the friend or chatroom of the conversation
+    """
+    conversationIndexFile = 'conversations.json'
+
+    # (table, UsrName or None, row count) of every chat table, the largest first
+    def listConversations(self, cursor):
+        self._loadFriends(cursor)
+        owners = {}
+        for usrName in self.nicknames:
+            owners['Chat_'+hashlib.md5(usrName.encode('utf-8')).hexdigest()] = usrName
+        self._execute(cursor, self.SQL_Templates['list_chat_tables'])
+        tables = [row[0] for row in cursor.fetchall()]
+        conversations = []
+        for table in tables:
+            self._execute(cursor, self.SQL_Templates['count_rows'] % table)
+            conversations.append((table, owners.get(table), cursor.fetchone()[0]))
+        conversations.sort(key=operator.itemgetter(2), reverse=True)
+        return conversations
+
+    # an exporter of another chat table into its own folder, sharing the loaded nicknames
+    def _conversation(self, table):
+        config = self._config()
+        config['Chat_Table'] = table
+        config['htmlFolder'] = '%s%s/' % (self.htmlFolder, table[len('Chat_'):])
+        # the pages share the js/ and style/ of the html folder
+        config['assetFolder'] = self.assetFolder+'../'
+        conversation = self.__class__(**config)
+        conversation.nicknames = self.nicknames
+        if not os.path.isdir(conversation.htmlFolder):
+            os.makedirs(conversation.htmlFolder)
+        return conversation
+
+    def saveAllArchives(self, startTime, stopTime, singleScan=True, incremental=False, jobs=1,
+                        materialize=None):
+        """
+        export the daily archives of every conversation with messages in one run: one connection
+        per process, one load of the Friend nicknames and one pass over the attachment cache
+        :param jobs: number of worker processes, the conversations are handed out largest first
+        :param materialize: the mode of materializeAttachments to link the attachments of every
+                            conversation into its folder first, None to use the folders as they are
+        """
+        timestamp = str2epoch(startTime)
+        stoTimeStamp = str2epoch(stopTime)
+        self._openDB(allTables=True)
+        conversations = [c for c in self.listConversations(self.cur) if c[2] > 0]
+        cache = self._readAttachmentCache()
+        exporters = []
+        for table, usrName, rows in conversations:
+            conversation = self._conversation(table)
+            if materialize is not None:
+                conversation._materializeAttachments(self.cur, timestamp, stoTimeStamp, materialize,
+                                                     max(jobs, 4))
+            conversation._loadAttachments(cache)
+            exporters.append(conversation)
+        self._writeAttachmentCache(cache)
+
+        exported = {}
+        if jobs > 1:
+            pool = multiprocessing.Pool(jobs, _openConversationWorker,
+                                        (self.__class__, self._config(), self.nicknames))
+            chunks = [(c._config(), c.attachments, timestamp, stoTimeStamp, singleScan, incremental)
+                      for c in exporters]
+            for table, pages, profile in pool.imap_unordered(_exportConversation, chunks):
+                exported[table] = pages
+                self.profiler.merge(profile)
+            pool.close()
+            pool.join()
+        else:
+            for conversation in exporters:
+                conversation.conn, conversation.cur = self.conn, self.cur
+                conversation._exportArchive(timestamp, stoTimeStamp, singleScan, incremental, 1)
+                exported[conversation.Chat_Table] = conversation.exported
+                self.profiler.merge(conversation.profiler.export())
+        self._closeDB();
+
+        index = []
+        for table, usrName, rows in conversations:
+            pages = exported[table]
+            index.append({'table': table, 'folder': table[len('Chat_'):], 'usrName': usrName,
+                          'nickname': None if usrName is None else self._lookupNickname(usrName),
+                          'rows': rows, 'pages': len(pages), 'messages': sum([n for f, n in pages])})
+        fid = codecs.open(self.htmlFolder+self.conversationIndexFile, "w", encoding="utf-8")
+        fid.write(json.dumps(index))
+        fid.close()
+        print "...%d conversations exported" % len(index)
+        return index
+
+    # export the daily pages of [timestamp, stopTimeStamp) on the open connection
+    def _exportDays(self, timestamp, stopTimeStamp, singleScan, rebuild=None):
+        self.profiler.start()
+        if not self.pipeline:
+            return self._exportDayPages(timestamp, stopTimeStamp, singleScan, rebuild)
+        self.writer = PageWriter(self.writeBehindPages)
+        try:
+            self._exportDayPages(timestamp, stopTimeStamp, singleScan, rebuild)
+        finally:
+            writer, self.writer = self.writer, None
+            writer.close()
+        self.profiler.count('bytes.written', writer.bytes)
+
+    def _exportDayPages(self, timestamp, stopTimeStamp, singleScan, rebuild):
+        if singleScan:
+            self._scanDailyArchive(timestamp, stopTimeStamp, rebuild)
+            return None
+        self._prefetchStatBuckets(self.cur, timestamp, self.calendar.lastStop(stopTimeStamp))
+        while timestamp < stopTimeStamp:
+            if rebuild is not None and timestamp not in rebuild:
+                timestamp += DailyTimestampStep
+                continue
             self.speakerGraphs = self._initQueryStatistics();
-            if isMonthlyStart(timestamp):
+            if self.calendar.isMonthlyStart(timestamp):
                 self._queryMonthly(timestamp)
-            if isWeeklyStart(timestamp):
+            if self.calendar.isWeeklyStart(timestamp):
                 self._queryWeekly(timestamp)
             nt = self._queryDaily(timestamp)   
-            self.exportHTML()
+            self.exportPage()
             timestamp = nt
-        self._closeDB();
         return None
-    
+
+    # the constructor arguments to build an identical exporter in a worker process
+    def _config(self):
+        return {'dbFolder': self.dbFolder, 'htmlFolder': self.htmlFolder, 'Chat_Table': self.Chat_Table,
+                'dataProvider': self.dataProvider, 'dataProviderID': self.dataProviderID,
+                'timestamp_bias': self.time_bias, 'minute_thresh': self.minute_thresh,
+                'indexedDB': self.indexedDB, 'explainQueries': self.explainQueries,
+                'friendCache': self.friendCache, 'attachmentCache': self.attachmentCache,
+                'sharded': self.sharded, 'searchIndex': self.searchIndex, 'profile': self.profile,
+                'mmapSize': self.mmapSize, 'cacheSize': self.cacheSize, 'fetchSize': self.fetchSize,
+                'statCube': self.statCube, 'pipeline': self.pipeline, 'renderCache': self.renderCache,
+                'assetFolder': self.assetFolder}
+
+    def _exportParallel(self, timestamp, stopTimeStamp, singleScan, rebuild, jobs):
+        """
+        split the days into chunks exported by a pool of worker processes, each worker reads
+        past its last day to complete the monthly/weekly periods starting inside its chunk,
+        so the pages are identical to a sequential export
+        """
+        self._loadFriends(self.cur)
+        self._loadAttachments()
+        step = DailyTimestampStep
+        days = (stopTimeStamp-timestamp+step-1)/step
+        size = max(1, (days+4*jobs-1)/(4*jobs))
+        chunks = []
+        while timestamp < stopTimeStamp:
+            nt = min(timestamp+size*step, stopTimeStamp)
+            chunkRebuild = None
+            if rebuild is not None:
+                chunkRebuild = set([t for t in rebuild if timestamp <= t < nt])
+            if chunkRebuild is None or chunkRebuild:
+                chunks.append((self.__class__, self._config(), self.nicknames, self.attachments,
+                               timestamp, nt, singleScan, chunkRebuild))
+            timestamp = nt
+
+        pool = multiprocessing.Pool(jobs)
+        for exported, search, profile in pool.imap_unordered(_exportChunk, chunks):
+            self.exported.extend(exported)
+            self.profiler.merge(profile)
+            if search is not None:
+                self.search.extend(search)
+        pool.close()
+        pool.join()
+        print "...%d pages with %d messages exported by %d workers" % (
+            len(self.exported), sum([n for f, n in self.exported]), jobs)
+        return None
+
+    """
+    incremental export: the manifest records per period the row count, the max MsgLocalID and
+    a content hash, so that a re-export only rebuilds the pages of changed periods
+    """
+    manifestFile = 'manifest.json'
+
+    def _loadManifest(self):
+        filename = self.htmlFolder+self.manifestFile
+        if not os.path.exists(filename):
+            return {'settings': None, 'periods': {}}
+        fid = codecs.open(filename, "r", encoding="utf-8")
+        manifest = json.load(fid)
+        fid.close()
+        return manifest
+
+    def _saveManifest(self, manifest):
+        fid = codecs.open(self.htmlFolder+self.manifestFile, "w", encoding="utf-8")
+        fid.write(json.dumps(manifest))
+        fid.close()
+
+    # everything besides the messages that changes the pages: settings, nicknames and templates
+    def _settingsSignature(self):
+        settings = [self.Chat_Table, self.dataProvider, self.time_bias, self.minute_thresh,
+                    sorted(self.nicknames.iteritems()), self.sharded]
+        return hashlib.md5(json.dumps(settings+self._templateSettings())).hexdigest()
+
+    # the output templates, every attribute named *Template, in name order
+    def _templateSettings(self):
+        return [getattr(self, name) for name in sorted(dir(self)) if name.endswith('Template')]
+
+    # row count, max MsgLocalID and content hash of every daily step in the biased range [a, b)
+    def _daySignatures(self, cursor, a, b):
+        where, params = self._get_timeFrame_from_timestamp(a, b)
+        self._execute(cursor, self.SQL_Templates['get_messages'] % (self.Chat_Table, where), params)
+        Items = self.Items
+        days = {}
+        for row in self._fetchRows(cursor):
+            day = (self.calendar.biased(row[Items['CreateTime']])-a)/DailyTimestampStep
+            if not days.has_key(day):
+                days[day] = {'count': 0, 'maxId': 0, 'hash': hashlib.md5()}
+            sig = days[day]
+            msgid = row[Items['MsgLocalID']]
+            sig['count'] += 1
+            sig['maxId'] = max(sig['maxId'], msgid)
+            sig['hash'].update(json.dumps([msgid, row[Items['CreateTime']], row[Items['Type']],
+                                           row[Items['Status']], row[Items['Message']]]))
+        for sig in days.itervalues():
+            sig['hash'] = sig['hash'].hexdigest()
+        return days
+
+    # combine the signatures of all daily steps overlapping the period [a, b)
+    def _periodSignature(self, days, origin, a, b):
+        step = DailyTimestampStep
+        sig = {'count': 0, 'maxId': 0, 'hash': hashlib.md5()}
+        for day in xrange((a-origin)/step, (b-origin+step-1)/step):
+            if days.has_key(day):
+                sig['count'] += days[day]['count']
+                sig['maxId'] = max(sig['maxId'], days[day]['maxId'])
+                sig['hash'].update(days[day]['hash'])
+        sig['hash'] = sig['hash'].hexdigest()
+        return sig
+
+    # return the day timestamps to rebuild and the manifest to save after the export
+    def _planIncremental(self, cursor, timestamp, stopTimeStamp):
+        self._loadFriends(cursor)
+        lastStop = self.calendar.lastStop(stopTimeStamp)
+        days = self._daySignatures(cursor, timestamp, lastStop)
+        manifest = self._loadManifest()
+        settings = self._settingsSignature()
+        changed = manifest['settings'] != settings
+        previous = manifest['periods']
+        manifest['settings'] = settings
+
+        origin = timestamp
+        rebuild = set()
+        while timestamp < stopTimeStamp:
+            nt = timestamp + DailyTimestampStep
+            periods = [('daily', timestamp, nt)]
+            if self.calendar.isMonthlyStart(timestamp):
+                periods.append(('monthly', timestamp, self.calendar.month(timestamp)[1]))
+            if self.calendar.isWeeklyStart(timestamp):
+                periods.append(('weekly', timestamp, self.calendar.week(timestamp)[1]))
+            dirty = changed
+            for statType, a, b in periods:
+                key = '%s %s' % (statType, self.calendar.date(a))
+                sig = self._periodSignature(days, origin, a, b)
+                if previous.get(key) != sig:
+                    dirty = True
+                previous[key] = sig
+            filename = self._pagePath(self.calendar.date(timestamp))
+            if days.has_key((timestamp-origin)/DailyTimestampStep) and not os.path.exists(filename):
+                dirty = True
+            if dirty:
+                rebuild.add(timestamp)
+            timestamp = nt
+        return rebuild, manifest
+
+    # load the nicknames of all friends with one query, or from the friend cache file
+    def _loadFriends(self, cursor):
+        if self.nicknames is not None:
+            return None
+        mtime = os.path.getmtime(self.dbFolder+'/'+self.dbFile)
+        cacheFile = self.friendCache
+        if cacheFile is not None and os.path.exists(cacheFile):
+            fid = codecs.open(cacheFile, "r", encoding="utf-8")
+            cache = json.load(fid)
+            fid.close()
+            if cache['mtime'] == mtime:
+                self.nicknames = cache['nicknames']
+                return None
+
+        self._execute(cursor, self.SQL_Templates['get_friend_nicknames'])
+        nicknames = {}
+        for usrName, nickname in cursor:
+            if not nicknames.has_key(usrName):
+                nicknames[usrName] = nickname
+        self.profiler.count('sql.rows', len(nicknames))
+        self.nicknames = nicknames
+        if cacheFile is not None:
+            fid = codecs.open(cacheFile, "w", encoding="utf-8")
+            fid.write(json.dumps({'mtime': mtime, 'nicknames': nicknames}))
+            fid.close()
+
+    def _lookupNickname(self, usrName):
+        return self.nicknames.get(usrName, usrName)
+
+    # yield (UsrName, speaker, timestamp, type, id, message) for the biased range [a, b) in time order
+    def _scanMessages(self, cursor, a, b, nicknames):
+        self._loadFriends(cursor)
+        if self.pipeline:
+            # the reader thread gets a cursor of its own
+            cursor = self.conn.cursor()
+        where, params = self._get_timeFrame_from_timestamp(a, b)
+        self._execute(cursor, self.SQL_Templates['get_messages'] % (self.Chat_Table, where), params)
+        Items = self.Items
+        rows = 0
+        if self.pipeline:
+            fetched = readAhead(functools.partial(cursor.fetchmany, self.fetchSize), self.readAheadBatches)
+        else:
+            fetched = self._fetchRows(cursor)
+        for row in fetched:
+            rows += 1
+            msg = row[Items['Message']]
+            msgtype = row[Items['Type']]
+            idx = msg.find(':\n')
+            usr = self.dataProvider if idx < 0 else msg[0:idx]
+            if not nicknames.has_key(usr):
+                nicknames[usr] = self._lookupNickname(usr)
+            speaker, idx = self._parseSpeaker(msg, msgtype, nicknames)
+            timestamp = self.calendar.biased(row[Items['CreateTime']])
+            yield usr, speaker, timestamp, msgtype, row[Items['MsgLocalID']], msg[idx+1:].strip()
+        self.profiler.count('sql.rows', rows)
+
+    def _dispatchMessage(self, message, periods):
+        usr, speaker, timestamp, msgtype, msgid, msg = message
+        targets = [acc for acc in periods if acc.start <= timestamp < acc.stop]
+        rendered = None
+        for acc in targets:
+            if acc.withRecords and rendered is None:
+                rendered = self.processMessage( msg, msgtype, msgid )
+            acc.add(usr, speaker, timestamp, msgtype, rendered, msgid)
+
+    def _loadPeriod(self, acc):
+        for field in acc.fields:
+            setattr(self, field, getattr(acc, field))
+
+    # export the daily page once the monthly/weekly periods starting on that day are closed
+    def _exportPage(self, page):
+        for acc in page.itervalues():
+            if not acc.closed:
+                return False
+        self.speakerGraphs = self._initQueryStatistics();
+        for key in ('monthly', 'weekly', 'daily'):
+            if page.has_key(key):
+                self._loadPeriod(page[key])
+                self.speakerGraphs[key] = self._ensembleSpeakerGraph()
+        self.exportPage()
+        return True
+
+    def _scanDailyArchive(self, timestamp, stopTimeStamp, rebuild=None):
+        lastStop = self.calendar.lastStop(stopTimeStamp)
+        nicknames = {}
+        messages = self._scanMessages(self.cur, timestamp, lastStop, nicknames)
+        message = next(messages, None)
+        opened = []  # monthly and weekly periods still collecting messages
+        pending = [] # daily pages waiting for the graph of their monthly/weekly period
+        while timestamp < stopTimeStamp or opened:
+            if rebuild is not None and not rebuild and not opened:
+                break
+            if timestamp < stopTimeStamp and rebuild is not None and timestamp not in rebuild:
+                # an unchanged day, only the periods opened earlier take its messages
+                page = None
+                nt = timestamp + DailyTimestampStep
+                periods = opened
+            elif timestamp < stopTimeStamp:
+                page = {}
+                if self.calendar.isMonthlyStart(timestamp):
+                    t, nt = self._setMonthlyPeriod(timestamp)
+                    page['monthly'] = PeriodAccumulator(self, timestamp, nt)
+                if self.calendar.isWeeklyStart(timestamp):
+                    t, nt, weekID = self._setWeeklyPeriod(timestamp)
+                    page['weekly'] = PeriodAccumulator(self, timestamp, nt)
+                opened.extend(page.values())
+                nt = self._setDailyPeriod(timestamp)
+                page['daily'] = PeriodAccumulator(self, timestamp, nt, withRecords=True)
+                periods = opened+[page['daily']]
+            else:
+                # only the periods running past the last day are left
+                page = None
+                nt = max([acc.stop for acc in opened])
+                periods = opened
+
+            while message is not None and message[2] < nt:
+                self._dispatchMessage(message, periods)
+                message = next(messages, None)
+            timestamp = nt
+
+            for acc in periods:
+                if acc.stop <= timestamp or message is None:
+                    acc.close(nicknames, self.MsgType_dict)
+            opened = [acc for acc in opened if not acc.closed]
+            if page is not None:
+                pending.append(page)
+            pending = [p for p in pending if not self._exportPage(p)]
+        return None
+
+# worker process entry of Chat2HTML_EXPORTER._exportParallel, returns the exported pages
+# and the records to search
+def _exportChunk(args):
+    cls, config, nicknames, attachments, timestamp, stopTimeStamp, singleScan, rebuild = args
+    worker = cls(**config)
+    worker.nicknames = nicknames
+    worker.attachments = attachments
+    worker._openDB(readOnly=True)
+    worker._exportDays(timestamp, stopTimeStamp, singleScan, rebuild)
+    worker._closeDB()
+    return worker.exported, worker.search, worker.profiler.export()
+
+# the exporter of the worker process of Chat2HTML_EXPORTER.saveAllArchives, its connection
+# is reused by all the conversations exported in the process
+_conversationWorker = None
+
+def _openConversationWorker(cls, config, nicknames):
+    global _conversationWorker
+    _conversationWorker = cls(**config)
+    _conversationWorker.nicknames = nicknames
+    _conversationWorker._openDB(readOnly=True)
+
+def _exportConversation(args):
+    config, attachments, timestamp, stopTimeStamp, singleScan, incremental = args
+    worker = _conversationWorker
+    conversation = worker.__class__(**config)
+    conversation.nicknames = worker.nicknames
+    conversation.attachments = attachments
+    conversation.conn, conversation.cur = worker.conn, worker.cur
+    conversation._exportArchive(timestamp, stopTimeStamp, singleScan, incremental, 1)
+    return conversation.Chat_Table, conversation.exported, conversation.profiler.export()
+
 def main():
-    narg = len(sys.argv);
     currentYear = time.strftime("%Y");
-    startTime = currentYear+"-01-01";
-    endTime = time.strftime("%Y-%m-%d")
-    queryName = "this year till now"
-    
-    if narg >= 2:
-        startTime = str(sys.argv[1])
-    if narg >= 3:
-        endTime = str(sys.argv[2])
-    if narg >= 4:
-        queryName = str(sys.argv[3])
-        
+    parser = argparse.ArgumentParser(description="export wechat chat records into daily html archives")
+    parser.add_argument("startTime", nargs='?', default=currentYear+"-01-01", help="first day, yyyy-mm-dd")
+    parser.add_argument("endTime", nargs='?', default=time.strftime("%Y-%m-%d"), help="stop day (excluded), yyyy-mm-dd")
+    parser.add_argument("queryName", nargs='?', default="this year till now")
+    parser.add_argument("--jobs", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--incremental", action="store_true", help="only rebuild the pages of changed periods")
+    parser.add_argument("--sharded", action="store_true", help="write json shards and one viewer page index.html")
+    parser.add_argument("--search", choices=['shards', 'fts5'], help="build a full text search index")
+    parser.add_argument("--all", action="store_true", help="export every conversation into its own folder")
+    parser.add_argument("--jsonl", metavar="FILE", help="stream the messages and stats of the range as json lines "
+                        "into FILE instead of the html pages, gzip compressed when FILE ends with .gz")
+    parser.add_argument("--stat-cube", metavar="FILE", help="sidecar database of the message count per day, "
+                        "type and speaker, updated on use")
+    parser.add_argument("--stats", action="store_true", help="print the statistics of the range as json "
+                        "instead of exporting, summed from --stat-cube when given")
+    parser.add_argument("--pipeline", action="store_true", help="read the rows ahead and write the pages "
+                        "behind the rendering in threads of their own")
+    parser.add_argument("--render-cache", action="store_true", help="keep the rendered links and emotions "
+                        "in html/render.sqlite between runs")
+    parser.add_argument("--materialize", choices=['link', 'symlink'],
+                        help="link the attachments of the exported days from the backup into the html folder")
+    parser.add_argument("--profile", metavar="FILE", help="write the stage timings and counters as json")
+    parser.add_argument("--cprofile", metavar="FILE", help="write cProfile stats of the main process, "
+                        "readable by pstats, snakeviz or flameprof")
+    args = parser.parse_args()
+    startTime = args.startTime
+    endTime = args.endTime
+    queryName = args.queryName
         
-    worker = Chat2HTML_EXPORTER()
+    worker = Chat2HTML_EXPORTER(sharded=args.sharded, searchIndex=args.search,
+                                profile=args.profile is not None, statCube=args.stat_cube,
+                                pipeline=args.pipeline, renderCache=args.render_cache)
     #worker.loadData( startTime, endTime, queryName, 'UserDefined' )
     #worker.exportHTML()
-    worker.saveDailyArchive(startTime, endTime)
+    if args.stats:
+        print json.dumps(worker.rangeStat(startTime, endTime, queryName), indent=1)
+        return
+    if args.jsonl:
+        worker.saveArchiveJSONL(startTime, endTime, args.jsonl, queryName)
+        if args.profile:
+            worker.profiler.save(args.profile)
+        return
+    export = worker.saveDailyArchive
+    if args.all:
+        export = functools.partial(worker.saveAllArchives, materialize=args.materialize)
+    elif args.materialize:
+        worker.materializeAttachments(startTime, endTime, args.materialize, max(args.jobs, 4))
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.runcall(export, startTime, endTime, singleScan=True,
+                         incremental=args.incremental, jobs=args.jobs)
+        profiler.dump_stats(args.cprofile)
+    else:
+        export(startTime, endTime, singleScan=True, incremental=args.incremental, jobs=args.jobs)
+    if args.profile:
+        worker.profiler.save(args.profile)
+        print "...profile written to %s" % args.profile
     #worker.saveWeeklyStatJSON(startTime, endTime)    
     #worker.saveMonthlyStatJSON(startTime, endTime)
     
@@ -31,12 +31,14 @@ Support:
 - view other chat records by clicking on a date from the jquery datepicker
 - initiate speakerGraph objects corresponding to the daily/weekly/monthly speaker graph (SG) content
 (the above function depends on the script of gssbSpeakerGraph.js)
+- sharded archive: the viewer page index.html loads the json shard of the date picked in the
+  datepicker and renders it in place, only the dates listed in the shard index are selectable
+  (the shards are fetched with ajax, serve the html folder over http to browse it)
 
 */
 function messagesSelect( key, value ) {    
-    $('div.message').hide();
-    var selector = 'div.message['+key+'="'+value+'"]';
-    $(selector).show();
+    // compared as attribute values, a name with quotes or brackets would break a selector
+    $('div.message').hide().filter(function() { return $(this).attr(key) === value; }).show();
 }
 
 function messageAll() {
@@ -48,27 +50,118 @@ function messageAllatAnchor( id ) {
     location.href = "#"+id;
 }
  
-function load( date ) {
-    var scriptName = "json/"+date+".json";
-    console.log(scriptName);
-    var loader = $.getScript(scriptName)
-	.done(function(data, textStatus) {
-	    console.log(textStatus);
+function bindMessages() {
+    $('span.speakerShow').click(function(){
+	messagesSelect('speaker', $(this).text());
+    });
+    $('span.typeShow').click(function(){
+	messagesSelect('msgtype', $(this).attr('msgtype'));
+    });
+    $('span.total').click(function(){
+	messageAll();
+    });
+    $('div.timestamp').click(function(){
+	messageAllatAnchor( $(this).parent().attr('id'));
+    });
+}
+
+function drawSpeakerGraphs( d ) {
+    var keys = ['monthly', 'weekly', 'daily'];
+    for (var i = 0; i < keys.length; i++) {
+	var c = d3.select('.'+keys[i]+'SG');
+	c.selectAll('svg').remove();
+	if (d[keys[i]] !== null)
+	    new SpeakerGraph(c, d[keys[i]]);
+    }
+}
+
+// the statistic and record markup of exportStatHTML and exportRecordHTML, built from a shard
+function renderShard( shard, msgTypes ) {
+    var stat = $('<div class="stat" class="daily"></div>');
+    stat.append($('<div class="queryName"></div>').text(shard.queryName));
+    var typeStat = $('<div class="typeStat"></div>')
+	.append($('<span class="total"></span>').text(shard.messageTotal+' Messages:'));
+    $.each(shard.messageStat, function(i, item) {
+	if (item[1] === 0)
+	    return;
+	typeStat.append($('<div class="typeData"></div>').text(item[1]+' ')
+			.append($('<span class="typeShow"></span>').attr('msgtype', item[0]).text(msgTypes[item[0]])));
+    });
+    var speakerStat = $('<div class="speakerStat"></div>')
+	.append($('<span class="total"></span>').text('from '+shard.speakerTotal+' speakers:'));
+    $.each(shard.speakerStat, function(i, item) {
+	speakerStat.append($('<div class="speakerData"></div>')
+			   .append($('<span class="speakerShow"></span>').text(item[0]))
+			   .append(' '+item[1]));
+    });
+    $('div.statArea').empty().append(stat.append(typeStat).append(speakerStat));
+
+    // record: [timestamp, speaker, msgtype, message html, time string, MesLocalID]
+    var records = [];
+    $.each(shard.record, function(i, r) {
+	records.push($('<div class="message"></div>')
+		     .attr({id: r[0], msgid: r[5], speaker: r[1], msgtype: r[2]})
+		     .append($('<div class="timestamp"></div>').text(r[4]))
+		     .append($('<span class="speakerShow"></span>').text(r[1]))
+		     .append($('<span class="content"></span>').html(r[3])));
+    });
+    $('div.records').empty().append(records);
+
+    bindMessages();
+    drawSpeakerGraphs(shard.speakerGraphs);
+}
+
+function loadShard( index, date, id ) {
+    $.getJSON(index.folder+date+".json")
+	.done(function(shard) {
+	    renderShard(shard, index.msgTypes);
+	    location.hash = date;
+	    if (id !== undefined)
+		$('div.message[id="'+id+'"]')[0].scrollIntoView();
 	})
-	.fail(function( jqxhr, settings, exception) {
+	.fail(function(jqxhr) {
 	    console.log(jqxhr.status);
 	});
-    var loader = $.ajax({
-	url: scriptName,
-	type: 'get',
-	error: function(data) {console.log(data);},
-	success: function(data) {
-	    console.log(data);
-	}
+}
+
+function openShardViewer( indexName ) {
+    $.getJSON(indexName).done(function(index) {
+	var dates = Object.keys(index.days).sort();
+	// #date or #date/record id, as linked from search.html
+	var anchor = location.hash.substring(1).split('/');
+	var date = anchor[0];
+	if (!index.days.hasOwnProperty(date))
+	    date = dates[dates.length-1];
+
+	$( "#datepicker" ).datepicker({
+	    showWeek: true, 
+	    firstDay: 1,
+	    dateFormat: "yy-mm-dd",
+	    defaultDate: date,
+	    minDate: dates[0],
+	    maxDate: dates[dates.length-1],
+	    nextText: '',
+	    prevText: '',
+	    beforeShowDay: function(day) {
+		var dateText = $.datepicker.formatDate("yy-mm-dd", day);
+		return [index.days.hasOwnProperty(dateText), ''];
+	    },
+	    onSelect: function(dateText){
+		loadShard(index, dateText);
+	    }
+	});
+	if (date !== undefined)
+	    loadShard(index, date, anchor[1]);
     });
 }
 
 $(document).ready(function(){
+    if (typeof shardIndex !== 'undefined') {
+	openShardViewer(shardIndex);
+	return;
+    }
+    if (speakerGraphs === null)
+	return;
     d = speakerGraphs;
     name = d.daily.label;
 
@@ -87,30 +180,6 @@ $(document).ready(function(){
 	}
     });
     
-    $('span.speakerShow').click(function(){
-	messagesSelect('speaker', $(this).html());
-    });
-    $('span.typeShow').click(function(){
-	messagesSelect('msgtype', $(this).attr('msgtype'));
-    });
-    $('span.total').click(function(){
-	messageAll();
-    });
-    $('div.timestamp').click(function(){
-	messageAllatAnchor( $(this).parent().attr('id'));
-    });
-
-    var c = d3.select('.monthlySG');
-    if (d.monthly !== null) {
-	new SpeakerGraph(c, d.monthly);
-    }
- 
-    c = d3.select('.weeklySG')
-    if (d.weekly !== null) {
-	new SpeakerGraph(c, d.weekly);
-    }
-    if (d.daily !== null)
-	new SpeakerGraph(d3.select('.dailySG'), d.daily);
-
-    
+    bindMessages();
+    drawSpeakerGraphs(d);
 });
@@ -0,0 +1,162 @@
+/*
+The MIT License (MIT)
+
+Copyright (c) 2014 Jianxia Xue xuejianxia@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+gssbSearch.js
+
+Support:
+- full text search of the text and link messages on search.html
+- the query is cut into the tokens of chat_search.py, only the posting shards of these tokens are
+  fetched, the records containing all tokens are then checked against the query on their day page
+(the postings are fetched with ajax, serve the html folder over http to use it)
+
+*/
+
+var TokenPattern = /([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+)|([0-9a-z]+)/g;
+// days checked for the query text per search
+var searchDays = 30;
+
+// the same tokens as chat_search.tokenize
+function tokenize( text ) {
+    var tokens = {}, m;
+    TokenPattern.lastIndex = 0;
+    while ((m = TokenPattern.exec(text.toLowerCase())) !== null) {
+	if (m[2] !== undefined) {
+	    tokens[m[2]] = true;
+	    continue;
+	}
+	for (var i = 0; i < m[1].length; i++) {
+	    tokens[m[1].charAt(i)] = true;
+	    if (i+1 < m[1].length)
+		tokens[m[1].substr(i, 2)] = true;
+	}
+    }
+    return Object.keys(tokens);
+}
+
+// the same shard as chat_search.tokenShard
+function tokenShard( token, shards ) {
+    var h = 0;
+    for (var i = 0; i < token.length; i++)
+	h = (Math.imul(h, 31)+token.charCodeAt(i)) >>> 0;
+    return h % shards;
+}
+
+var SearchIndex = function( config ) {
+    this.config = config;
+    this.shards = {};
+    this.meta = $.getJSON(config.meta);
+};
+
+// the deferred {day: [record id, ...]} of the records having all the tokens
+SearchIndex.prototype.candidates = function( tokens ) {
+    var self = this;
+    return this.meta.then(function(meta) {
+	var needed = {};
+	$.each(tokens, function(i, token) {
+	    var k = tokenShard(token, meta.shards);
+	    if (!self.shards.hasOwnProperty(k))
+		self.shards[k] = $.getJSON(self.config.folder+k+".json");
+	    needed[k] = self.shards[k];
+	});
+	var keys = Object.keys(needed);
+	return $.when.apply($, keys.map(function(k) { return needed[k]; })).then(function() {
+	    var loaded = {};
+	    var results = keys.length == 1 ? [arguments] : arguments;
+	    $.each(keys, function(i, k) { loaded[k] = results[i][0]; });
+	    var hits = null;
+	    $.each(tokens, function(i, token) {
+		var flat = loaded[tokenShard(token, meta.shards)][token] || [];
+		var found = {};
+		for (var j = 0; j < flat.length; j += 2)
+		    found[meta.days[flat[j]]+'/'+flat[j+1]] = true;
+		if (hits === null) {
+		    hits = found;
+		    return;
+		}
+		for (var key in hits)
+		    if (!found.hasOwnProperty(key))
+			delete hits[key];
+	    });
+	    var days = {};
+	    for (var key in hits) {
+		var p = key.split('/');
+		(days[p[0]] = days[p[0]] || []).push(p[1]);
+	    }
+	    return days;
+	});
+    });
+};
+
+// the deferred [[anchor, speaker, time string, html], ...] of the given record ids (MesLocalID) of a day
+SearchIndex.prototype.records = function( day, ids ) {
+    var url = this.config.records.replace('{day}', day);
+    if (this.config.sharded)
+	return $.getJSON(url).then(function(shard) {
+	    return $.grep(shard.record, function(r) { return ids.indexOf(String(r[5])) >= 0; })
+		.map(function(r) { return [r[0], r[1], r[4], r[3]]; });
+	});
+    return $.get(url).then(function(html) {
+	var page = $('<div></div>').html(html);
+	return ids.map(function(id) {
+	    var m = page.find('div.message[msgid="'+id+'"]');
+	    return [m.attr('id'), m.attr('speaker'), m.find('div.timestamp').text(), m.find('span.content').html()];
+	});
+    });
+};
+
+SearchIndex.prototype.search = function( query, results ) {
+    var self = this;
+    var tokens = tokenize(query);
+    results.empty();
+    if (tokens.length === 0)
+	return;
+    var text = query.toLowerCase();
+    this.candidates(tokens).then(function(days) {
+	var dates = Object.keys(days).sort().reverse();
+	results.append($('<div class="searchTotal"></div>').text(dates.length+' days'));
+	$.each(dates.slice(0, searchDays), function(i, day) {
+	    var block = $('<div class="searchDay"></div>').appendTo(results);
+	    self.records(day, days[day]).then(function(records) {
+		$.each(records, function(j, r) {
+		    // the n-grams only narrow down the candidates
+		    if ($('<div></div>').html(r[3]).text().toLowerCase().indexOf(text) < 0)
+			return;
+		    var link = self.config.page.replace('{day}', day).replace('{id}', r[0]);
+		    block.append($('<div class="message"></div>')
+				 .append($('<a class="timestamp"></a>').attr('href', link).text(r[2]))
+				 .append($('<span class="speakerShow"></span>').text(r[1]))
+				 .append($('<span class="content"></span>').html(r[3])));
+		});
+	    });
+	});
+    });
+};
+
+$(document).ready(function(){
+    if (typeof searchConfig === 'undefined')
+	return;
+    var index = new SearchIndex(searchConfig);
+    $('#searchQuery').change(function(){
+	index.search($(this).val(), $('div.searchResults'));
+    });
+});
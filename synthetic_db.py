@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+The MIT License (MIT)
+
+Copyright (c) 2014 Jianxia Xue xuejianxia@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+synthetic WeChat backup for the exporter, no phone needed:
+    <root>/DB/MM.sqlite   the Friend table and the Chat_<md5> tables
+    <root>/html/...       dummy attachments of the first chat table (Img, OpenData, Video, Audio, emoticon1),
+                          as for the export of the default chat table
+    <root>/html/<md5>/... the attachments of every chat table, the first one included, as for --all
+The type mix follows the counts listed in data_extract.py, the messages come in bursts of
+conversation during the day, and a few speakers write most of them.
+
+usage: python synthetic_db.py root --messages 100000 --speakers 50 --start 2014-01-01 --days 365
+"""
+import sqlite3, random, hashlib, os, sys, time, datetime, argparse
+
+from chat_calendar import str2epoch, DailyTimestampStep
+
+# the chat table of the exporter's default configuration comes first
+MainTable = 'Chat_28228f7a9f1a43c84f9045374383c8a4'
+
+# message type weights from the type counts in data_extract.py
+TypeWeights = [(1, 51791), (3, 1646), (47, 341), (49, 221), (34, 177), (10000, 92),
+               (43, 12), (48, 9), (42, 2)]
+
+Texts = [u'hello', u'ok', u'see you tomorrow', u'哈哈', u'你好世界\n再见', u'收到', u'好的，明天见',
+         u'http://www.example.com/article', u'今天的会议改到下午三点', u'thanks!']
+
+ChatSchema = '''create table %s(TableVer integer default 1, MesLocalID integer primary key autoincrement,
+    MesSvrID integer default 0, CreateTime integer default 0, Message text, Status integer default 0,
+    ImgStatus integer default 0, Type integer, Des integer)'''
+FriendSchema = '''create table Friend(UsrName text unique, NickName text, Type integer)'''
+
+# a random type following TypeWeights
+def pickType( rng ):
+    x = rng.random()*sum([w for t, w in TypeWeights])
+    for msgtype, weight in TypeWeights:
+        x -= weight
+        if x < 0:
+            return msgtype
+    return 1
+
+# the Message column of one message, and the attachments it refers to as (folder, file name)
+def makeMessage( rng, msgtype, usrName, own, msgid, emojis ):
+    prefix = '' if own else usrName+':\n'
+    if msgtype == 1:
+        return prefix+rng.choice(Texts), []
+    if msgtype == 3:
+        files = [('Img', '%d.t.jpg' % msgid)]
+        if rng.random() < 0.5:
+            files.append(('Img', '%d.jpg' % msgid))
+        return prefix+'<msg><img length="%d" hdlength="0" /></msg>' % rng.randint(1000, 99999), files
+    if msgtype == 34:
+        return prefix+'<msg><voicemsg endflag="1" length="%d" voicelength="%d" /></msg>' % (
+            rng.randint(1000, 9999), rng.randint(1000, 60000)), [('Audio', '%d.wav' % msgid)]
+    if msgtype == 43:
+        # own videos and locations carry the speaker in fromusername
+        return prefix+'<msg><videomsg length="%d" playlength="%d" fromusername="%s" /></msg>' % (
+            rng.randint(10000, 999999), rng.randint(1, 60), usrName), [('Video', '%d.mp4' % msgid)]
+    if msgtype == 47:
+        md5 = rng.choice(emojis)
+        return prefix+'<msg><emoji fromusername="%s" tousername="room@chatroom" type="2" md5="%s" len="%d" /></msg>' % (
+            usrName, md5, rng.randint(1000, 99999)), [('emoticon1', '%s.t.jpg' % md5)]
+    if msgtype == 48:
+        return '<msg><location x="%.6f" y="%.6f" scale="16" label="%s" maptype="0" poiname="" fromusername="%s" /></msg>' % (
+            rng.uniform(-90, 90), rng.uniform(-180, 180), 'Somewhere %d' % rng.randint(1, 99), usrName), []
+    if msgtype == 49:
+        if rng.random() < 0.2:
+            return prefix+'<msg><appmsg appid="" sdkver="0"><title>report-%d.pdf</title><des></des><type>6</type><url></url></appmsg></msg>' % msgid, \
+                [('OpenData', '%d.pdf' % msgid)]
+        n = rng.randint(1, 500)
+        return prefix+'<msg><appmsg appid="" sdkver="0"><title>Article %d</title><des>About article %d</des><type>5</type><url>http://mp.example.com/s?id=%d</url></appmsg></msg>' % (
+            n, n, n), []
+    if msgtype == 10000:
+        return u'"%s" joined the group chat' % usrName, []
+    return prefix+'<?xml version="1.0"?>\n<msg><appinfo/></msg>', []
+
+# message times with the given count in [start, start+days), bursts of messages during the day
+def messageTimes( rng, count, start, days ):
+    times = []
+    while len(times) < count:
+        day = rng.randrange(days)
+        t = start + day*DailyTimestampStep + int(rng.triangular(7, 24, 20)*3600)
+        for i in range(min(int(rng.expovariate(1.0/15))+1, count-len(times))):
+            times.append(t)
+            t += int(rng.expovariate(1.0/40))
+    times.sort()
+    return times
+
+def generate( root, messages=20000, speakers=30, start='2014-01-01', days=90, tables=1, seed=1 ):
+    """
+    write the synthetic backup below root, an existing MM.sqlite is replaced
+    :param messages: messages of the first chat table, the other tables get a tenth each
+    :param speakers: friends speaking in the chats, besides the owner
+    :param start, days: the date span of the messages
+    :param tables: number of chat tables
+    :return: {table: message count}
+    """
+    rng = random.Random(seed)
+    dbFolder = os.path.join(root, 'DB')
+    if not os.path.isdir(dbFolder):
+        os.makedirs(dbFolder)
+    dbFile = os.path.join(dbFolder, 'MM.sqlite')
+    if os.path.exists(dbFile):
+        os.remove(dbFile)
+    conn = sqlite3.connect(dbFile)
+    conn.execute(FriendSchema)
+    users = ['wxid_%012x' % rng.getrandbits(48) for i in range(speakers)]
+    conn.executemany('insert into Friend values (?, ?, 0)',
+                     [(usr, u'朋友%d' % i) for i, usr in enumerate(users)])
+    # a few speakers write most of the messages
+    activity = [1.0/(i+1) for i in range(speakers)]
+    emojis = [hashlib.md5(str(i)).hexdigest() for i in range(40)]
+    t0 = str2epoch(start)
+
+    counts = {}
+    for k in range(tables):
+        if k == 0:
+            table = MainTable
+        else:
+            owner = users[k % speakers]
+            table = 'Chat_'+hashlib.md5(owner).hexdigest()
+        folders = [os.path.join(root, 'html', table[len('Chat_'):])]
+        if k == 0:
+            folders.append(os.path.join(root, 'html'))
+        if table in counts:
+            continue
+        count = messages if k == 0 else max(1, messages/10)
+        conn.execute(ChatSchema % table)
+        rows = []
+        files = set()
+        for msgid, t in enumerate(messageTimes(rng, count, t0, days), 1):
+            own = rng.random() < 0.1
+            x = rng.random()*sum(activity)
+            for usr, weight in zip(users, activity):
+                x -= weight
+                if x < 0:
+                    break
+            msgtype = pickType(rng)
+            msg, attached = makeMessage(rng, msgtype, usr, own, msgid, emojis)
+            files.update(attached)
+            rows.append((t, msg, 2 if own else 4, 2 if msgtype == 3 else 1, msgtype, 0 if own else 1))
+        conn.executemany('''insert into %s(CreateTime, Message, Status, ImgStatus, Type, Des)
+                            values (?, ?, ?, ?, ?, ?)''' % table, rows)
+        for folder in folders:
+            for sub, name in files:
+                path = os.path.join(folder, sub)
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+                fid = open(os.path.join(path, name), 'wb')
+                fid.write('\0'*16)
+                fid.close()
+        counts[table] = len(rows)
+    conn.commit()
+    conn.close()
+    return counts
+
+
+parser = argparse.ArgumentParser(description="write a synthetic MM.sqlite with dummy attachments")
+parser.add_argument("root", help="output folder, gets DB/MM.sqlite and html/")
+parser.add_argument("--messages", type=int, default=20000, help="messages of the main chat table")
+parser.add_argument("--speakers", type=int, default=30, help="number of friends speaking")
+parser.add_argument("--start", default="2014-01-01", help="first day, yyyy-mm-dd")
+parser.add_argument("--days", type=int, default=90, help="date span in days")
+parser.add_argument("--tables", type=int, default=1, help="number of chat tables")
+parser.add_argument("--seed", type=int, default=1, help="random seed")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    counts = generate(args.root, args.messages, args.speakers, args.start, args.days, args.tables, args.seed)
+    for table, count in sorted(counts.iteritems()):
+        print "%s %d messages" % (table, count)